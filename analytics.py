@@ -0,0 +1,103 @@
+# Download and view counts for the library program
+
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Kinds of events counted per book and day
+KINDS = ("download", "view")
+
+
+class ReadEvents:
+    """
+    Count downloads and views of books without a write per request.
+
+    Events go into a ring buffer in memory, holding at most `capacity` of
+    them (the oldest are dropped, and counted as dropped, if the database
+    falls behind). A background thread adds them up every `flush_seconds`
+    and writes the totals per book and day to book_stats, and per book to
+    book_popularity, in one transaction. Whatever is still buffered is
+    written when the process exits.
+    """
+
+    def __init__(self, db, capacity=10000, flush_seconds=30):
+        self.db = db
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._worker = None
+        atexit.register(self.flush)
+
+    def record(self, book_id, kind):
+        """Count one download or view of a book; kind is one of KINDS."""
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind of read: {kind}")
+        day = datetime.now(timezone.utc).date().isoformat()
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append((book_id, day, kind))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name="library-read-events", daemon=True)
+                self._worker.start()
+
+    def flush(self):
+        """Write the buffered events to the database; returns how many there were."""
+        with self._flushing:
+            with self._lock:
+                events, self._events = self._events, deque(maxlen=self._events.maxlen)
+            if not events:
+                return 0
+
+            # [downloads, views] per book and day, and per book
+            days, totals = {}, {}
+            for book_id, day, kind in events:
+                days.setdefault((book_id, day), [0, 0])[kind == "view"] += 1
+                totals.setdefault(book_id, [0, 0])[kind == "view"] += 1
+
+            try:
+                with self.db.transaction():
+                    # Books deleted since their events were recorded are skipped
+                    self.db.executemany(
+                        'INSERT INTO "book_stats" ("book_id", "day", "downloads", "views") '
+                        'SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM "books" WHERE "id" = ?) '
+                        'ON CONFLICT ("book_id", "day") DO UPDATE SET '
+                        '"downloads" = "downloads" + excluded."downloads", "views" = "views" + excluded."views"',
+                        [(book_id, day, downloads, views, book_id) for (book_id, day), (downloads, views) in days.items()],
+                    )
+                    self.db.executemany(
+                        'INSERT INTO "book_popularity" ("book_id", "downloads", "views") '
+                        'SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM "books" WHERE "id" = ?) '
+                        'ON CONFLICT ("book_id") DO UPDATE SET '
+                        '"downloads" = "downloads" + excluded."downloads", "views" = "views" + excluded."views"',
+                        [(book_id, downloads, views, book_id) for book_id, (downloads, views) in totals.items()],
+                    )
+            except Exception:
+                # Put the events back in front of newer ones; if that overfills the buffer the newest go
+                with self._lock:
+                    self._events.extendleft(reversed(events))
+                raise
+            return len(events)
+
+    def _work(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing read events failed")
+
+
+def week_start(today=None):
+    """The first day, as stored in book_stats, of the seven days up to today."""
+    today = today or datetime.now(timezone.utc).date()
+    return (today - timedelta(days=6)).isoformat()
@@ -1,73 +1,303 @@
 
 import ast
+import base64
+import binascii
+import click
 import os
-import fitz
 import secrets
-from cs50 import SQL
+import time
 from datetime import date
-from flask_session import Session
 from flask_wtf.csrf import CSRFProtect
-from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer
 from email_validator import validate_email, EmailNotValidError
-from flask import Flask, flash, redirect, render_template, request, session, url_for
-from helpers import ForgottenForms, bienvenido, check_password_strength, clean_user_input, graci, gracias, list_to_string, login_required, apology, titlecase, BookForm
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, Flask, current_app, flash, redirect, render_template, request, send_file, send_from_directory, session, url_for
+from analytics import ReadEvents, week_start
+from books import DuplicateBook, insert_book, isbn_exists, parse_authors
+from cache import ResultCache, shared_cache
+from catalog import catalog_drift, rebuild_catalog, unpack_authors
+from covers import THUMBNAIL_WIDTHS, make_thumbnails, remove_thumbnails, srcset, thumbnail_name
+from database import Database
+from mailer import init_outbox, message, queue_mail, send_pending, start_sender
+from optimize import optimize_pdf
+from metrics import init_metrics, render as render_metrics, span
+from passwords import HasherBusy, PasswordHasher
+from ratelimit import TokenBucketLimiter
+from recommendations import SORTS as RECOMMENDATION_SORTS, RecommendationQueue
+from roles import AdminRoles
+from search import MARK_END, MARK_START, WEIGHTS as SEARCH_WEIGHTS, index_book_pages, match_query, rebuild_search_index
+from sessions import RedisSessionStore, ServerSessionInterface, SQLiteSessionStore
+from suggest import SuggestionIndex
+from tasks import MAX_ATTEMPTS, VISIBILITY_SECONDS, depth, enqueue, init_tasks, retry_failed, run_pending, task, work
+from uploads import UploadError, UploadStore, store_content_addressed
+from importer import import_books
+from helpers import ForgottenForms, age, bienvenido, check_password_strength, cover_extension, decode_cursor, encode_cursor, file_digest, graci, gracias, highlight, login_required, pdf_page_count, apology, titlecase, BookForm
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
 
-# Configure application
-app = Flask(__name__)
-secret_key = secrets.token_hex(16)
-# app.secret_key = "_53oi3uriq9pidklsfner7t8weipoqlpl"
-csrf = CSRFProtect(app)
+# Routes, hooks and commands of the library, registered on the app by create_app()
+bp = Blueprint("library", __name__, cli_group=None)
+csrf = CSRFProtect()
+
+# Services used by the routes and jobs below, set up by create_app(); there
+# is one library app per process
+db = cache = passwords = login_limiter = login_ip_limiter = None
+uploads = roles = reads = suggestions = recommendations = serializer = None
+
+
+def create_app(config=None):
+    """
+    Build the library app, configured from the environment and then config.
+
+    config may set any of the settings below, for example another DATABASE,
+    UPLOAD_FOLDER or MAIL_SUPPRESS_SEND, before the services that use them
+    are set up. "flask run" and WSGI servers call create_app() with none.
+    """
+    global db, cache, passwords, login_limiter, login_ip_limiter
+    global uploads, roles, reads, suggestions, recommendations, serializer
+
+    # Configure application
+    app = Flask(__name__)
+    # app.secret_key = "_53oi3uriq9pidklsfner7t8weipoqlpl"
+
+    app.config["SECRET_KEY"] = secrets.token_hex(16)
+    app.config["UPLOAD_FOLDER"] = "static/files/books"
+    app.config["UPLOAD_IMG_FOLDER"] = "static/files/book_covers"
+    app.config["THUMBNAIL_FOLDER"] = "static/files/book_covers/thumbs"
+
+    # Thumbnails are named by content hash, so browsers may keep them for a year
+    app.config["COVER_CACHE_MAX_AGE"] = 365 * 24 * 60 * 60
+
+    # How long browsers may reuse a downloaded book before revalidating its ETag
+    app.config["BOOK_CACHE_MAX_AGE"] = int(os.getenv("BOOK_CACHE_MAX_AGE", 86400))
+
+    # Let a front-end server (Apache/lighttpd X-Sendfile) stream book files itself
+    app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+
+    # Partial files of resumable uploads, and the largest book accepted
+    app.config["UPLOAD_PARTIAL_FOLDER"] = "uploads"
+    app.config["UPLOAD_MAX_LENGTH"] = int(os.getenv("UPLOAD_MAX_LENGTH", 1024 * 1024 * 1024))
+
+    # Background job threads in each web process (0 leaves jobs to "flask worker"),
+    # and how old an unreferenced file must be before "flask collect-orphans" deletes it
+    app.config["TASK_WORKERS"] = int(os.getenv("TASK_WORKERS", 1))
+    app.config["ORPHAN_GRACE_SECONDS"] = 60 * 60
+
+    # Rewrite uploaded PDFs compressed and linearized, optionally resampling images
+    # shown above PDF_MAX_IMAGE_DPI (0 keeps images as they are)
+    app.config["PDF_OPTIMIZE"] = os.getenv("PDF_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+    app.config["PDF_MAX_IMAGE_DPI"] = int(os.getenv("PDF_MAX_IMAGE_DPI", 0))
+
+    # Number of books shown per page on the shelf
+    app.config["SHELF_PAGE_SIZE"] = int(os.getenv("SHELF_PAGE_SIZE", 24))
+    app.config["SHELF_MAX_PAGE_SIZE"] = 100
+
+    # Most books returned for a single search
+    app.config["SEARCH_LIMIT"] = 50
+
+    # Downloads and views buffered in memory (at most READ_EVENTS_CAPACITY) and
+    # written to the database every READ_EVENTS_FLUSH_SECONDS
+    app.config["READ_EVENTS_CAPACITY"] = int(os.getenv("READ_EVENTS_CAPACITY", 10000))
+    app.config["READ_EVENTS_FLUSH_SECONDS"] = int(os.getenv("READ_EVENTS_FLUSH_SECONDS", 30))
+
+    # Book recommendations shown per page to admins
+    app.config["RECOMMENDATIONS_PAGE_SIZE"] = int(os.getenv("RECOMMENDATIONS_PAGE_SIZE", 50))
+
+    # Flask-Mail configuration (point MAIL_SERVER at a local SMTP stand-in such as
+    # "python -m aiosmtpd -n -l localhost:8025" when developing)
+    app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+    app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 587))
+    app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() in ("1", "true", "yes")
+    app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
+    app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
+    app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER")
+    # Keep mail in the outbox log instead of sending it, for development and tests
+    app.config["MAIL_SUPPRESS_SEND"] = os.getenv("MAIL_SUPPRESS_SEND", "").lower() in ("1", "true", "yes")
+
+    # Ensure templates are auto-reloaded
+    app.config["TEMPLATES_AUTO_RELOAD"] = True
+
+    # Configure pooled access to the SQLite database
+    app.config["DATABASE"] = os.getenv("DATABASE", "library.db")
+    app.config["DATABASE_POOL_SIZE"] = int(os.getenv("DATABASE_POOL_SIZE", 8))
+    app.config["DATABASE_BUSY_TIMEOUT"] = int(os.getenv("DATABASE_BUSY_TIMEOUT", 5000))  # milliseconds
+    app.config["DATABASE_CACHE_SIZE"] = int(os.getenv("DATABASE_CACHE_SIZE", -20000))  # negative means KiB
+    app.config["DATABASE_MMAP_SIZE"] = int(os.getenv("DATABASE_MMAP_SIZE", 256 * 1024 * 1024))
+
+    # Time every request and SQL statement for /metrics, logging statements slower
+    # than SLOW_QUERY_MS and the statements of requests slower than SLOW_REQUEST_MS.
+    # /metrics answers scrapes bearing "Authorization: Bearer METRICS_TOKEN", and
+    # otherwise only those from the comma-separated addresses in METRICS_ALLOW
+    # (none by default). Behind a reverse proxy every request comes from the
+    # proxy's address, so set TRUSTED_PROXIES before allowing addresses
+    app.config["SLOW_QUERY_MS"] = int(os.getenv("SLOW_QUERY_MS", 100))
+    app.config["SLOW_REQUEST_MS"] = int(os.getenv("SLOW_REQUEST_MS", 1000))
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN", "")
+    app.config["METRICS_ALLOW"] = [address.strip() for address in os.getenv("METRICS_ALLOW", "").split(",") if address.strip()]
+
+    # Number of reverse proxies in front of the app (1 for a single nginx) whose
+    # X-Forwarded-For and X-Forwarded-Proto headers are trusted, so that the
+    # login rate limits and METRICS_ALLOW see the client's address
+    app.config["TRUSTED_PROXIES"] = int(os.getenv("TRUSTED_PROXIES", 0))
+
+    # Cache shelf pages and search results: an LRU of CACHE_SIZE entries in each
+    # process, plus a tier shared between processes so that invalidations reach
+    # every worker. The default folder serves the workers of one machine; use
+    # redis://host when several machines serve the library. An empty CACHE_URL
+    # turns the shared tier off, which is only safe with a single process
+    app.config["CACHE_SIZE"] = int(os.getenv("CACHE_SIZE", 256))
+    app.config["CACHE_TTL"] = int(os.getenv("CACHE_TTL", 300))  # seconds
+    app.config["CACHE_URL"] = os.getenv("CACHE_URL", "file://cache")
+
+    # Bring the schema up to date with migrations/ when the app starts
+    app.config["MIGRATIONS_FOLDER"] = os.path.join(app.root_path, "migrations")
+    app.config["AUTO_MIGRATE"] = os.getenv("AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+    # Keep sessions on the server, in the library database ("sqlite") or in a
+    # Redis server shared by every app server ("redis", at SESSION_REDIS_URL)
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "sqlite")
+    app.config["SESSION_REDIS_URL"] = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+    app.config["SESSION_SWEEP_SECONDS"] = int(os.getenv("SESSION_SWEEP_SECONDS", 600))
+
+    # Hash passwords in worker processes; changing PASSWORD_METHOD rehashes each
+    # user's password the next time they log in
+    app.config["PASSWORD_METHOD"] = os.getenv("PASSWORD_METHOD", "scrypt:32768:8:1")
+    app.config["PASSWORD_WORKERS"] = int(os.getenv("PASSWORD_WORKERS", 2))
+
+    # Login attempts allowed per username and per client address
+    app.config["LOGIN_ATTEMPTS_PER_MINUTE"] = int(os.getenv("LOGIN_ATTEMPTS_PER_MINUTE", 10))
+    app.config["LOGIN_BURST"] = int(os.getenv("LOGIN_BURST", 5))
+    app.config["LOGIN_IP_ATTEMPTS_PER_MINUTE"] = int(os.getenv("LOGIN_IP_ATTEMPTS_PER_MINUTE", 60))
+    app.config["LOGIN_IP_BURST"] = int(os.getenv("LOGIN_IP_BURST", 20))
+
+    # Titles and author names completed as the user types, reloaded every
+    # SUGGEST_REFRESH_SECONDS to pick up books added by other processes
+    app.config["SUGGEST_REFRESH_SECONDS"] = int(os.getenv("SUGGEST_REFRESH_SECONDS", 300))
+    app.config["SUGGEST_LIMIT"] = 10
+
+    # Settings given by the caller win over the environment
+    app.config.update(config or {})
+
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"], x_proto=app.config["TRUSTED_PROXIES"])
+
+    csrf.init_app(app)
+
+    # Pooled access to the SQLite database
+    db = Database(
+        app.config["DATABASE"],
+        pool_size=app.config["DATABASE_POOL_SIZE"],
+        busy_timeout=app.config["DATABASE_BUSY_TIMEOUT"],
+        cache_size=app.config["DATABASE_CACHE_SIZE"],
+        mmap_size=app.config["DATABASE_MMAP_SIZE"],
+    )
+    init_metrics(app, db, slow_query_ms=app.config["SLOW_QUERY_MS"], slow_request_ms=app.config["SLOW_REQUEST_MS"])
+
+    cache = ResultCache(
+        maxsize=app.config["CACHE_SIZE"],
+        ttl=app.config["CACHE_TTL"],
+        shared=shared_cache(app.config["CACHE_URL"], app.config["CACHE_TTL"]),
+    )
+
+    # Book recommendations, one entry per title with a vote per reader
+    recommendations = RecommendationQueue(db)
+
+    # Bring the schema up to date, moving recommendations left in the old table into the queue
+    if app.config["AUTO_MIGRATE"]:
+        db.migrate(app.config["MIGRATIONS_FOLDER"])
+        recommendations.import_legacy()
+
+    if app.config["SESSION_BACKEND"] == "redis":
+        session_store = RedisSessionStore(app.config["SESSION_REDIS_URL"])
+    else:
+        session_store = SQLiteSessionStore(db, sweep_seconds=app.config["SESSION_SWEEP_SECONDS"])
+    app.session_interface = ServerSessionInterface(session_store)
+
+    # Let templates build srcset values for cover thumbnails
+    app.jinja_env.globals["cover_srcset"] = lambda key: srcset(key, lambda name: url_for(".cover", name=name))
+    app.jinja_env.globals["thumbnail_name"] = thumbnail_name
+    app.jinja_env.filters["age"] = age
+
+    passwords = PasswordHasher(app.config["PASSWORD_METHOD"], workers=app.config["PASSWORD_WORKERS"])
+    login_limiter = TokenBucketLimiter(app.config["LOGIN_ATTEMPTS_PER_MINUTE"], app.config["LOGIN_BURST"])
+    login_ip_limiter = TokenBucketLimiter(app.config["LOGIN_IP_ATTEMPTS_PER_MINUTE"], app.config["LOGIN_IP_BURST"])
+
+    # Run page counting, thumbnails, text extraction and file cleanup as durable jobs
+    init_tasks(app, db, threads=app.config["TASK_WORKERS"])
+
+    # Chunked uploads of book files, continued from any worker
+    uploads = UploadStore(db, app.config["UPLOAD_PARTIAL_FOLDER"], app.config["UPLOAD_MAX_LENGTH"])
+
+    # Admin ids, cached until a grant or revoke changes them
+    roles = AdminRoles(db)
+
+    # Count downloads and views in batches instead of writing on every download
+    reads = ReadEvents(db, capacity=app.config["READ_EVENTS_CAPACITY"], flush_seconds=app.config["READ_EVENTS_FLUSH_SECONDS"])
+
+    suggestions = SuggestionIndex(db, refresh_seconds=app.config["SUGGEST_REFRESH_SECONDS"])
+
+    # Send mail from a background worker through the outbox table
+    init_outbox(app, db)
 
-app.config["SECRET_KEY"] = secret_key
-app.config["UPLOAD_FOLDER"] = "static/files/books"
-app.config["UPLOAD_IMG_FOLDER"] = "static/files/book_covers"
+    # Serializer for token generation
+    serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"])
 
-# Flask-Mail configuration
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
-app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
-app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
-app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER")
-mail = Mail(app)
+    app.register_blueprint(bp)
+    return app
 
-# Configure session to use filesystem (instead of signed cookies)
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
 
-# Ensure templates are auto-reloaded
-app.config["TEMPLATES_AUTO_RELOAD"] = True
+# Endpoints that set their own validators and caching policy
+CACHEABLE_ENDPOINTS = {"static", "library.download_book", "library.cover"}
 
-# Configure CS50 Library to use SQLite database
-db = SQL("sqlite:///library.db")
+# Endpoints that never depend on the admin role, and skip rechecking it
+ROLELESS_ENDPOINTS = CACHEABLE_ENDPOINTS | {"library.search_suggest", "library.metrics"}
 
-# Serializer for token generation
-serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"])
 
+@bp.before_app_request
+def refresh_role():
+    """Recheck whether the signed-in user is an admin after roles changed"""
+    if request.endpoint in ROLELESS_ENDPOINTS or session.get("user_id") is None:
+        return
+    version = roles.version()
+    if session.get("roles_version") != version:
+        session["is_admin"] = roles.is_admin(session["user_id"])
+        session["roles_version"] = version
 
-@app.after_request
+
+@bp.teardown_app_request
+def close_transaction(exception):
+    """Roll back a transaction a failed request left open"""
+    db.reset()
+
+
+@bp.after_app_request
 def after_request(response):
     """Ensure responses aren't cached"""
+    if request.endpoint in CACHEABLE_ENDPOINTS:
+        return response
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Expires"] = 0
     response.headers["Pragma"] = "no-cache"
     return response
 
 
-@app.route("/")
+@bp.app_errorhandler(HasherBusy)
+def hasher_busy(err):
+    """Ask the user to come back when too many passwords are being hashed"""
+    return apology("too many sign-ins right now, please try again shortly", 503)
+
+
+@bp.route("/")
 def index():
     """Display Welcome page"""
     return render_template("index.html")
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     """Register new user into library after Validating input"""
 
@@ -106,10 +336,10 @@ def register():
             name = titlecase(str(request.form.get("fullname"))).strip()
             db.execute("INSERT INTO users (name, username, mail, hash) VALUES(?, ?, ?, ?)",
                 name, str(request.form.get("username").strip()),
-                email, generate_password_hash(password))
+                email, passwords.hash(request.form.get("password").strip()))
 
             # Send Welcome mail to new user
-            mail.send(graci(email, name))
+            queue_mail(graci(email, name))
         else:
             return apology(f"Password requires at least {password}", 400)
 
@@ -119,7 +349,7 @@ def register():
     else:
         return render_template("register.html")
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """Log user in"""
     # Forget any user_id
@@ -136,41 +366,53 @@ def login():
         if not request.form.get("password"):
             return apology("please provide password", 400)
 
+        # Refuse bursts of attempts on one account or from one address
+        username = str(request.form.get("username").strip())
+        if not login_limiter.allow(username.lower()) or not login_ip_limiter.allow(request.remote_addr):
+            return apology("too many login attempts, please wait a minute", 429)
+
         # Query database for username
         try:
             validate_email(str(request.form.get("username")))
             rows = db.execute(
-                "SELECT * FROM users WHERE mail LIKE ?", str(request.form.get("username").strip())
+                "SELECT * FROM users WHERE mail LIKE ?", username
             )
 
             # Ensure username exists and password is correct
-            if len(rows) != 1 or not check_password_hash(
+            if len(rows) != 1 or not passwords.check(
                 rows[0]["hash"], request.form.get("password")
             ):
                 return apology("Invalid mail and/or password", 400)
         except EmailNotValidError:
         # elif not validate_email(str(request.form.get("username").strip())):
             rows = db.execute(
-                "SELECT * FROM users WHERE username LIKE ?", str(request.form.get("username").strip())
+                "SELECT * FROM users WHERE username LIKE ?", username
             )
 
             # Ensure username exists and password is correct
-            if len(rows) != 1 or not check_password_hash(
+            if len(rows) != 1 or not passwords.check(
                 rows[0]["hash"], request.form.get("password")
             ):
                 return apology("Invalid username and/or password", 400)
+
+        # Move the stored hash to the configured method now that the password is known
+        if passwords.needs_rehash(rows[0]["hash"]):
+            db.execute("UPDATE users SET hash = ? WHERE id = ?", passwords.hash(request.form.get("password")), rows[0]["id"])
             
-        # Remember which user has logged in
+        # Remember which user has logged in, under a session id never used before
+        session.regenerate()
         session["user_id"] = rows[0]["id"]
         session["name"] = rows[0]["name"]
         session["username"] = rows[0]["username"]
 
-        # Get all admins in database create an admin session list of admin user
-        admins = db.execute("SELECT user_id FROM admins")
-        session["admins"] = [admin["user_id"] for admin in admins] # session["admins"] is a list
+        # The first user is always an admin
         user_id = rows[0]["id"]
-        if user_id == 1 and user_id not in session.get("admins", []):
-            db.execute("INSERT INTO admins (user_id) VALUES (?)", user_id)
+        if user_id == 1:
+            roles.grant(user_id)
+
+        # Carry the role in the session; refresh_role updates it if roles change
+        session["is_admin"] = roles.is_admin(user_id)
+        session["roles_version"] = roles.version()
 
 
         # Redirect user to home page
@@ -181,7 +423,7 @@ def login():
         return render_template("login.html")
     
 
-@app.route("/addbook", methods=["GET", "POST"])
+@bp.route("/addbook", methods=["GET", "POST"])
 @login_required
 def addbook():
     """Administrators control"""
@@ -193,166 +435,521 @@ def addbook():
         publisher = form.publisher.data.strip()
         year = form.year.data.strip()
         isbn = form.isbn.data.strip()
-        _author = form.author.data
-        _country = form.country.data
-        _birth = form.birth.data
+        try:
+            authors = parse_authors(form.author.data, form.country.data, form.birth.data)
+        except ValueError as err:
+            flash(f"Error: {err}.")
+            return redirect(request.url)
 
         # Check if book already exist
-        check_books = db.execute("SELECT isbn FROM books")
-        if isbn in [row["isbn"] for row in check_books]:
+        if isbn_exists(db, isbn):
             return "Book Already In Database"
-        
+
         pdf_file = form.pdf_file.data
         if "pdf_file" in form.errors:
             flash(form.errors["pdf_file"][0], "danger")
-        pdf_filename = os.path.join(app.config["UPLOAD_FOLDER"], pdf_file.filename)
-        pdf_file.save(pdf_filename)
-
         cover_image = form.cover_image.data
         if "cover_image" in form.errors:
             flash(form.errors["cover_image"][0], "danger")
-        cover_filename = os.path.join(app.config["UPLOAD_IMG_FOLDER"], cover_image.filename)
-        cover_image.save(cover_filename)
 
-        # Get number of pages
         try:
-            pdf_document = fitz.open(pdf_filename)
-            num_pages = pdf_document.page_count
+            # Store the book under its hash, so the same file uploaded twice is kept once
+            os.makedirs(current_app.config["UPLOAD_PARTIAL_FOLDER"], exist_ok=True)
+            partial = os.path.join(current_app.config["UPLOAD_PARTIAL_FOLDER"], f"{secrets.token_urlsafe(16)}.part")
+            pdf_file.save(partial)
+            if not pdf_page_count(partial):
+                os.remove(partial)
+                raise ValueError("the book file is not a readable PDF")
+            digest = file_digest(partial)
+            pdf_filename, created = store_content_addressed(
+                partial, digest, current_app.config["UPLOAD_FOLDER"], os.path.splitext(pdf_file.filename)[1])
+
+            shelve_book(title, isbn, year, publisher, authors, pdf_filename, digest,
+                        cover_image if cover_image and cover_image.filename else None,
+                        new_files=[pdf_filename] if created else [])
+        except DuplicateBook:
+            return "Book Already In Database"
         except Exception as err:
-            # If form validation fails or it's a GET request, flash an error message
             flash(f"Error: {err}.")
-            pdf_document.close()
             return redirect(request.url)
-        finally:
-            if pdf_document:
-                pdf_document.close()
 
-        
-        # Make insertions into tables
+        # Redirect Admin to Book Shelf to see the new book uploaded
+        return redirect(url_for('.shelf'))
 
-        db.execute("BEGIN TRANSACTION")
-        names = db.execute("SELECT publisher FROM publishers")
-        if titlecase(publisher) in [row["publisher"] for row in names]:
-            pub_id = db.execute("SELECT id FROM publishers WHERE publisher = ?", titlecase(publisher))[0]["id"]
-        else:
-            pub_id = db.execute("INSERT INTO publishers (publisher) VALUES (?)", titlecase(publisher))
+    return render_template("addbook.html", form=form)
 
-        book_id = db.execute("INSERT INTO books (isbn, title, year, publisher_id, pages) VALUES (?, ?, ?, ?, ?)", isbn, titlecase(title), year, pub_id, num_pages)
-        db.execute("INSERT INTO files (book_id, book_path, book_img_path) VALUES (?, ?, ?)", book_id, pdf_filename, cover_filename)
-        
-        # INSERT author(s) info into authors table and book/author ids into authored table
-        if "," in _author:
-            author = list_to_string(_author)
-            country = list_to_string(_country)
-            birth = list_to_string(_birth)
-            for i in range(len(author)):
-                author_id = get_author_id(author[i], clean_user_input(country[i]), birth[i])
-                db.execute("INSERT INTO authored (author_id, book_id) VALUES (?, ?)", author_id, book_id)
-        else:
-            author_id = get_author_id(_author, clean_user_input(_country), _birth)
-            db.execute("INSERT INTO authored (author_id, book_id) VALUES (?, ?)", author_id, book_id)
 
-        
-        # Redirect Admin to Book Shelf to see the new book uploaded
-        db.execute("COMMIT")
-        return redirect(url_for('shelf'))
+# Helper function to put a stored book file on the shelf
+def shelve_book(title, isbn, year, publisher, authors, pdf_path, sha256, cover_image=None, new_files=()):
+    """
+    Insert a book whose file is already stored and queue the work on its file.
 
-    return render_template("addbook.html", form=form)
+    The page count, thumbnails and page text are filled in by background jobs,
+    so the request returns as soon as the book is in the catalog. cover_image
+    is an optional uploaded image; without one the thumbnails come from page 1.
+    new_files lists files stored for this book alone, which are removed again
+    if it can't be added. Returns the id of the new book.
+    """
+    saved = list(new_files)
+    try:
+        cover_filename = None
+        if cover_image:
+            # Covers are stored under their hash too; the client's file name is never used
+            extension = cover_extension(cover_image.stream)
+            if not extension:
+                raise ValueError("the cover must be a JPEG, PNG or BMP image")
+            os.makedirs(current_app.config["UPLOAD_PARTIAL_FOLDER"], exist_ok=True)
+            partial = os.path.join(current_app.config["UPLOAD_PARTIAL_FOLDER"], f"{secrets.token_urlsafe(16)}.part")
+            cover_image.save(partial)
+            cover_filename, created = store_content_addressed(
+                partial, file_digest(partial), current_app.config["UPLOAD_IMG_FOLDER"], extension)
+            if created:
+                saved.append(cover_filename)
+
+        # Make insertions into tables; inspect_book fills in pages and thumbnails
+        book_id = insert_book(
+            db, title, isbn, year, publisher, authors, 0, pdf_path, cover_filename or "", sha256,
+        )
+    except Exception:
+        for path in saved:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    cache.invalidate()
+    suggestions.add_book(book_id, titlecase(title), [name for name, _, _ in authors])
+    recommendations.resolve_title(title, book_id)
+    enqueue("inspect_book", book_id)
+    return book_id
+
+# Background jobs on the files of books
+@task("inspect_book")
+def inspect_book(book_id):
+    """Count a new book's pages and make its thumbnails, then queue its text for indexing."""
+    rows = db.execute("SELECT book_path, book_img_path FROM files WHERE book_id = ?", book_id)
+    if not rows:
+        return
+    book_path, cover_path = rows[0]["book_path"], rows[0]["book_img_path"] or None
+
+    import fitz
+
+    with span("pdf_page_count"), fitz.open(book_path) as pdf_document:
+        num_pages = pdf_document.page_count
+
+    # Resize the cover into the thumbnails shown on the shelf
+    thumb_key = make_thumbnails(current_app.config["THUMBNAIL_FOLDER"], cover_path, book_path)
+    if not cover_path:
+        cover_path = os.path.join(current_app.config["THUMBNAIL_FOLDER"], thumbnail_name(thumb_key, max(THUMBNAIL_WIDTHS)))
+
+    with db.transaction():
+        db.execute("UPDATE books SET pages = ? WHERE id = ?", num_pages, book_id)
+        db.execute("UPDATE files SET book_img_path = ?, thumb_key = ? WHERE book_id = ?", cover_path, thumb_key, book_id)
+    cache.invalidate()
+    if current_app.config["PDF_OPTIMIZE"]:
+        enqueue("optimize_book", book_id)
+    enqueue("index_pages", book_id)
+
+@task("index_pages")
+def index_pages_job(book_id):
+    """Extract a book's page text into the search index."""
+    rows = db.execute("SELECT book_path FROM files WHERE book_id = ?", book_id)
+    if rows:
+        index_book_pages(db, book_id, rows[0]["book_path"])
+
+@task("optimize_book")
+def optimize_book(book_id):
+    """Shrink a book's stored file and record its size before and after."""
+    rows = db.execute("SELECT book_path FROM files WHERE book_id = ?", book_id)
+    if not rows:
+        return
+    book_path = rows[0]["book_path"]
+
+    # Books with the same upload share one file: claim it for this job in one
+    # statement, unless it was optimized already or another job is at it
+    now = time.time()
+    claimed = db.execute(
+        """
+        UPDATE files SET optimizing = ? WHERE book_path = ? AND NOT EXISTS (
+            SELECT 1 FROM files WHERE book_path = ? AND (stored_size IS NOT NULL OR optimizing > ?)
+        )
+        """,
+        now, book_path, book_path, now - VISIBILITY_SECONDS,
+    )
+    if not claimed:
+        # Take the sizes of the finished file; a running job records them for this book too
+        db.execute(
+            """
+            UPDATE files SET (original_size, stored_size, stored_sha256) = (
+                SELECT original_size, stored_size, stored_sha256 FROM files WHERE book_path = ? AND stored_size IS NOT NULL
+            ) WHERE book_id = ? AND stored_size IS NULL
+            """,
+            book_path, book_id,
+        )
+        return
+
+    try:
+        original_size, stored_size = optimize_pdf(book_path, current_app.config["PDF_MAX_IMAGE_DPI"])
+    except Exception:
+        db.execute("UPDATE files SET optimizing = NULL WHERE book_path = ?", book_path)
+        raise
+    # The file keeps the name its upload hashed to, so a later identical upload finds it
+    db.execute(
+        "UPDATE files SET original_size = ?, stored_size = ?, stored_sha256 = ?, optimizing = NULL WHERE book_path = ?",
+        original_size, stored_size, file_digest(book_path), book_path,
+    )
+
+@task("remove_unused_files")
+def remove_unused_files(paths, thumb_key=None):
+    """Delete stored files, and the thumbnails of thumb_key, once no book refers to them."""
+    for path in paths:
+        if path and os.path.dirname(path) != current_app.config["THUMBNAIL_FOLDER"] and os.path.exists(path) and not db.execute(
+                "SELECT 1 FROM files WHERE book_path = ? OR book_img_path = ?", path, path):
+            os.remove(path)
+    # Thumbnails are shared by books with the same cover, so keep them while still used
+    if thumb_key and not db.execute("SELECT 1 FROM files WHERE thumb_key = ?", thumb_key):
+        remove_thumbnails(current_app.config["THUMBNAIL_FOLDER"], thumb_key)
+
+@task("collect_orphans")
+def collect_orphans():
+    """
+    Delete book files, covers and thumbnails that no book refers to.
+
+    Files younger than ORPHAN_GRACE_SECONDS are left alone, as they may belong
+    to a book that is being added right now. Returns the number deleted.
+    """
+    rows = db.execute("SELECT book_path, book_img_path, thumb_key FROM files")
+    used = {row["book_path"] for row in rows} | {row["book_img_path"] for row in rows}
+    thumb_keys = {row["thumb_key"] for row in rows if row["thumb_key"]}
+    cutoff = time.time() - current_app.config["ORPHAN_GRACE_SECONDS"]
+
+    removed = 0
+    for folder in (current_app.config["UPLOAD_FOLDER"], current_app.config["UPLOAD_IMG_FOLDER"], current_app.config["THUMBNAIL_FOLDER"]):
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                continue
+            if folder == current_app.config["THUMBNAIL_FOLDER"]:
+                orphan = name.rsplit("-", 1)[0] not in thumb_keys
+            else:
+                orphan = path not in used
+            if orphan:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+# Resumable upload API, after the tus protocol: POST creates an upload of
+# Upload-Length bytes, PATCH sends bytes from Upload-Offset (as
+# application/offset+octet-stream), HEAD tells the offset to resume from, and
+# POST .../finish adds the book with the addbook fields. Requests carry the
+# session cookie and an X-CSRFToken header.
+@bp.route("/api/uploads", methods=["POST"])
+@login_required
+def create_upload():
+    if not session.get("is_admin"):
+        return {"error": "only admins can upload books"}, 403
+    metadata = {}
+    for pair in request.headers.get("Upload-Metadata", "").split(","):
+        if pair.strip():
+            key, _, value = pair.strip().partition(" ")
+            try:
+                metadata[key] = base64.b64decode(value, validate=True).decode() if value else ""
+            except (binascii.Error, UnicodeDecodeError, ValueError):
+                return {"error": f"Upload-Metadata {key} is not base64-encoded UTF-8"}, 400
+    try:
+        upload_id = uploads.create(session["user_id"], metadata.get("filename"), request.headers.get("Upload-Length", type=int))
+    except UploadError as err:
+        return {"error": str(err)}, err.status
+    location = url_for(".upload", upload_id=upload_id)
+    return {"id": upload_id, "location": location}, 201, {"Location": location, "Upload-Offset": "0", "Tus-Resumable": "1.0.0"}
 
+@bp.route("/api/uploads/<upload_id>", methods=["HEAD", "PATCH", "DELETE"])
+@login_required
+def upload(upload_id):
+    row = uploads.get(upload_id, session["user_id"])
+    if not row:
+        return {"error": "no such upload"}, 404
+    headers = {"Upload-Length": str(row["length"]), "Tus-Resumable": "1.0.0"}
+
+    if request.method == "DELETE":
+        uploads.discard(upload_id)
+        return "", 204, headers
+    if request.method == "HEAD":
+        return "", 200, dict(headers, **{"Upload-Offset": str(row["received"])})
+
+    if request.mimetype != "application/offset+octet-stream":
+        return {"error": "send bytes as application/offset+octet-stream"}, 415
+    try:
+        received = uploads.append(row, request.headers.get("Upload-Offset", type=int), request.stream)
+    except UploadError as err:
+        return {"error": str(err)}, err.status
+    return "", 204, dict(headers, **{"Upload-Offset": str(received)})
 
-@app.route("/recommendation", methods=["GET", "POST"])
+@bp.route("/api/uploads/<upload_id>/finish", methods=["POST"])
+@login_required
+def finish_upload(upload_id):
+    row = uploads.get(upload_id, session["user_id"])
+    if not row:
+        return {"error": "no such upload"}, 404
+    form = request.form
+    if not all(form.get(field, "").strip() for field in ("title", "publisher", "author", "country", "birth", "year", "isbn")):
+        return {"error": "title, publisher, author, country, birth, year and isbn are required"}, 400
+
+    # Optional client checksum, as tus sends it: "sha256 <base64 digest>"
+    checksum = None
+    if algorithm_value := request.headers.get("Upload-Checksum"):
+        algorithm, _, value = algorithm_value.partition(" ")
+        if algorithm.lower() != "sha256":
+            return {"error": "only sha256 checksums are supported"}, 400
+        try:
+            checksum = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            checksum = b""
+        if len(checksum) != 32:
+            return {"error": "Upload-Checksum must be a base64-encoded sha256 digest"}, 400
+        checksum = checksum.hex()
+
+    try:
+        authors = parse_authors(form["author"], form["country"], form["birth"])
+        if isbn_exists(db, form["isbn"].strip()):
+            raise DuplicateBook(form["isbn"].strip())
+        partial, digest = uploads.finish(row, checksum)
+        if not pdf_page_count(partial):
+            raise UploadError("the upload is not a readable PDF", 415)
+        # Keep the upload until the book is in, so a failed finish can be retried without sending it again
+        pdf_filename, created = store_content_addressed(
+            partial, digest, current_app.config["UPLOAD_FOLDER"], ".pdf", keep=True)
+        cover_image = request.files.get("cover_image")
+        book_id = shelve_book(
+            form["title"].strip(), form["isbn"].strip(), form["year"].strip(), form["publisher"].strip(), authors,
+            pdf_filename, digest, cover_image if cover_image and cover_image.filename else None,
+            new_files=[pdf_filename] if created else [],
+        )
+        uploads.discard(upload_id)
+    except UploadError as err:
+        return {"error": str(err)}, err.status
+    except DuplicateBook:
+        return {"error": "Book Already In Database"}, 409
+    except ValueError as err:
+        return {"error": str(err)}, 400
+    return {"book_id": book_id, "sha256": digest, "deduplicated": not created}, 201
+
+
+@bp.route("/recommendation", methods=["GET", "POST"])
 @login_required
 def recommend():
-    title = ""
+    """Vote for a book to be added to the library"""
+    title = request.args.get("title", "")
     if request.method == "POST":
-        suggestion = request.form.get("newBook").strip()
-        db.execute("INSERT INTO recommendations (user_id, recommendation) VALUES (?, ?)", session["user_id"], suggestion)
-        return redirect(url_for("shelf"))
+        if recommendations.add(session["user_id"], request.form.get("newBook", "")) is None:
+            return apology("must name a book", 400)
+        return redirect(url_for(".shelf"))
     return render_template("recommend.html", title=title)
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     """Log user out by forgetting any user_id and redirect user to login"""
     session.clear()
+    session.regenerate()
     return redirect("/")
 
 
-@app.route("/new_admin", methods=["GET", "POST"])
+@bp.route("/new_admin", methods=["GET", "POST"])
 def admins():
-    users = db.execute("SELECT * FROM users")
-    admins = db.execute("SELECT user_id FROM admins")
-    admin_ids = [admin["user_id"] for admin in admins]
-    session["admins"] = admin_ids
-
-
     if request.method == "POST":
         id = request.form.get("id")
         name = request.form.get("name")
         email = request.form.get("mail")
-        db.execute("INSERT INTO admins (user_id) VALUES (?)", id)
+        roles.grant(id)
 
         # Send an email to the newly added admin
-        mail.send(gracias(email, name))
+        queue_mail(gracias(email, name))
 
         # mail = request.form.get("mail")
         return f"{name} is now an Admin"
     
-    return render_template("newadmin.html", users=users, admins=admin_ids)
+    users = db.execute("SELECT id, name, username, mail FROM users")
+    return render_template("newadmin.html", users=users, admins=roles.ids())
 
-@app.route("/de_admin", methods=["POST"])
+@bp.route("/de_admin", methods=["POST"])
 def unadmin():
     id = request.form.get("id")
     email = request.form.get("mail")
     name = request.form.get("name")
-    db.execute("DELETE FROM admins WHERE user_id = ?", id)
+    roles.revoke(id)
     
     # Send a Welcome mail to the new admin
-    mail.send(bienvenido(email, name))
+    queue_mail(bienvenido(email, name))
 
     return f"{name} is no longer an Admin"
 
-@app.route("/suggestionsPage", methods=["GET", "POST"])
+@bp.route("/suggestionsPage", methods=["GET", "POST"])
+@login_required
 def suggest():
-    suggestions = db.execute("SELECT * FROM suggestions")
+    """Show admins the books readers asked for, most wanted first, and resolve or delete them in bulk"""
+    if not session.get("is_admin"):
+        return apology("only admins can see recommendations", 403)
+
     if request.method == "POST":
-        text = request.form.get("suggest")
-        db.execute("DELETE FROM recommendations WHERE recommendation = ?", text)
+        ids = request.form.getlist("ids", type=int)
+        if request.form.get("action") == "resolve":
+            flash(f"Resolved {recommendations.resolve(ids)} recommendations.")
+        elif request.form.get("action") == "delete":
+            flash(f"Deleted {recommendations.delete(ids)} recommendations.")
         return redirect(request.url)
-    return render_template("suggestion.html", suggestions=suggestions)
+
+    status = "resolved" if request.args.get("status") == "resolved" else "open"
+    sort = request.args.get("sort", "votes")
+    if sort not in RECOMMENDATION_SORTS:
+        sort = "votes"
+    size = current_app.config["RECOMMENDATIONS_PAGE_SIZE"]
+    page = max(1, request.args.get("page", 1, type=int))
+    rows, total = recommendations.page(resolved=status == "resolved", sort=sort, page=page, size=size)
+    return render_template("suggestion.html", suggestions=rows, total=total, page=page, pages=max(1, -(-total // size)),
+                           sort=sort, status=status, sorts=RECOMMENDATION_SORTS)
 
 
-@app.route("/shelf", methods=["GET", "POST"])
+@bp.route("/reports/reads")
+@login_required
+def reads_report():
+    """Show admins which books are read most, all time and this week"""
+    if not session.get("is_admin"):
+        return apology("only admins can see reports", 403)
+
+    # Include the reads this process has not written yet
+    reads.flush()
+    totals = db.execute(
+        "SELECT COALESCE(SUM(downloads), 0) AS downloads, COALESCE(SUM(views), 0) AS views FROM book_popularity")[0]
+    week = db.execute(
+        "SELECT COALESCE(SUM(downloads), 0) AS downloads, COALESCE(SUM(views), 0) AS views FROM book_stats WHERE day >= ?",
+        week_start())[0]
+    return render_template("reads.html", popular=most_read(50), trending=most_read(50, trending=True),
+                           totals=totals, week=week, dropped=reads.dropped)
+
+
+@bp.route("/shelf", methods=["GET", "POST"])
 @login_required
 def shelf():
     """Display books and their information"""
-    data = db.execute("SELECT * FROM longlist ORDER BY book_title")
     today = date.today()
     # Query all information needed for downloading the book
     if request.method == "POST":
-        text = titlecase(request.form.get("search").strip())
-        if row := db.execute("SELECT * FROM longlist WHERE book_title LIKE ?", f'%{text}%'):
+        text = request.form.get("search").strip()
+        if row := cache.get_or_set(f"search:{match_query(text)}", lambda: search_books(text)):
             return render_template("shelf.html", data=row, today=today)
-        elif row1 := db.execute("SELECT * FROM longlist WHERE author_name LIKE ?", f'%{text}%'):
-            return render_template("shelf.html", data=row1, today=today)
         else:
-            return render_template("recommend.html", title=text)
-    return render_template("shelf.html", data=data, today=today)
+            return render_template("recommend.html", title=titlecase(text))
+
+    size = request.args.get("size", current_app.config["SHELF_PAGE_SIZE"], type=int)
+    size = max(1, min(size, current_app.config["SHELF_MAX_PAGE_SIZE"]))
+
+    # The most read books, all time or this week, in one page
+    order = request.args.get("order")
+    if order in ("popular", "trending"):
+        data = cache.get_or_set(f"shelf:{order}:{size}", lambda: most_read(size, trending=order == "trending"))
+        return render_template("shelf.html", data=data, today=today, size=size, order=order)
+
+    # Page through the shelf by (title, id) cursor instead of loading every book
+    after = decode_cursor(request.args.get("after"))
+    before = decode_cursor(request.args.get("before"))
+    data, prev_cursor, next_cursor = cache.get_or_set(
+        f"shelf:{size}:{after}:{before}", lambda: shelf_page(size, after=after, before=before))
+    return render_template("shelf.html", data=data, today=today, size=size,
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+@bp.route("/books/<int:book_id>/download")
+@login_required
+def download_book(book_id):
+    """Send a book file, honouring Range, If-None-Match and If-Modified-Since"""
+    row = db.execute(
+        "SELECT f.book_path, COALESCE(f.stored_sha256, f.sha256) AS sha256, b.title "
+        "FROM files f JOIN books b ON b.id = f.book_id WHERE f.book_id = ?", book_id)
+    if not row or not os.path.isfile(row[0]["book_path"]):
+        return apology("book not found", 404)
+    book_path, digest = row[0]["book_path"], row[0]["sha256"]
+
+    # Books uploaded before hashes were recorded get theirs on first download
+    if not digest:
+        digest = file_digest(book_path)
+        db.execute("UPDATE files SET sha256 = ? WHERE book_id = ?", digest, book_id)
+
+    # send_file streams through the server's file wrapper (sendfile where available)
+    response = send_file(
+        os.path.abspath(book_path),
+        as_attachment=not request.args.get("view"),
+        download_name=(secure_filename(row[0]["title"]) or "book") + os.path.splitext(book_path)[1],
+        conditional=True,
+        etag=digest,
+        max_age=current_app.config["BOOK_CACHE_MAX_AGE"],
+    )
+    # Books are only for signed-in users, so keep them out of shared caches
+    response.cache_control.public = False
+    response.cache_control.private = True
+
+    # Count each reading once, not revalidations or the later ranges a viewer fetches
+    if response.status_code == 200 or (response.status_code == 206 and request.range.ranges[0][0] == 0):
+        reads.record(book_id, "view" if request.args.get("view") else "download")
+    return response
 
-@app.route("/del_book", methods=["POST"])
+@bp.route("/covers/<name>")
+def cover(name):
+    """Send a cover thumbnail; its name is a content hash, so it never changes"""
+    response = send_from_directory(
+        os.path.abspath(current_app.config["THUMBNAIL_FOLDER"]), name,
+        max_age=current_app.config["COVER_CACHE_MAX_AGE"],
+    )
+    response.cache_control.immutable = True
+    return response
+
+@bp.route("/metrics")
+def metrics():
+    """Request, query and job timings in the Prometheus text format"""
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        allowed = secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    else:
+        allowed = request.remote_addr in current_app.config["METRICS_ALLOW"]
+    if not allowed:
+        return "Forbidden\n", 403, {"Content-Type": "text/plain"}
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@bp.route("/api/search/suggest")
+@login_required
+def search_suggest():
+    """Complete what is typed into the search box with titles and author names"""
+    limit = max(1, min(request.args.get("limit", 8, type=int), current_app.config["SUGGEST_LIMIT"]))
+    return {"suggestions": [
+        {"text": text, "kind": kind} for text, kind in suggestions.suggest(request.args.get("q", ""), limit)
+    ]}
+
+@bp.route("/search/pages")
+@login_required
+def search_inside():
+    """Search the text inside books and show the matching pages"""
+    text = request.args.get("q", "").strip()
+    hits = search_pages(text) if text else []
+    return render_template("inside.html", hits=hits, text=text)
+
+@bp.route("/del_book", methods=["POST"])
 def del_book():
-    book_id = request.form.get("book_id")
+    book_id = request.form.get("book_id", type=int)
     if book_id:
-        row = db.execute("SELECT * FROM files WHERE book_id = ?", book_id)
-        book_pdf = row[0]["book_path"]
-        cover_img = row[0]["book_img_path"]
-        db.execute("DELETE FROM books WHERE id = ?", book_id)
-        os.remove(cover_img)
-        os.remove(book_pdf)
+        # Delete the book and queue the removal of its files in one transaction,
+        # so files are never left behind without a job to remove them
+        with db.transaction():
+            row = db.execute("SELECT * FROM files WHERE book_id = ?", book_id)
+            db.execute("DELETE FROM books WHERE id = ?", book_id)
+            if row:
+                enqueue("remove_unused_files", [row[0]["book_path"], row[0]["book_img_path"]], row[0]["thumb_key"])
+        cache.invalidate()
+        suggestions.remove_book(book_id)
     return redirect("/shelf")
 
 # Endpoint to request a password reset
-@app.route("/forgot_password", methods=["GET", "POST"])
+@bp.route("/forgot_password", methods=["GET", "POST"])
 def forgot_password():
 
     form = ForgottenForms()
@@ -371,19 +968,19 @@ def forgot_password():
     return render_template("forgot_password.html", form=form)
 
 # Endpoint to reset password (via link in email)
-@app.route("/reset_password/<token>", methods=["GET", "POST"])
+@bp.route("/reset_password/<token>", methods=["GET", "POST"])
 def reset_password(token):
     try:
         email = serializer.loads(token, max_age=3600)  # Token expires after 1 hour
     except:
         flash("Invalid or expired reset link. Please request a new one.", "error")
-        return redirect(url_for("forgot_password"))
+        return redirect(url_for(".forgot_password"))
 
     if request.method == "POST":
         new_password = request.form.get("new_password").strip()
         update_password(email, new_password)
         flash("Password reset successfully. You can now log in with your new password.", "success")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
 
     return render_template("reset_password.html", token=token)
 
@@ -398,30 +995,250 @@ def generate_reset_token(email):
 
 # Helper function to send a reset email 
 def send_reset_email(email, token):
-    reset_url = url_for("reset_password", token=token, _external=True)
+    reset_url = url_for(".reset_password", token=token, _external=True)
     subject = "Password Reset Request"
     body = f"To Reset Your Password \n Click the following link to reset your password: {reset_url} \n This link will expire in 1hour"
-    msg = Message(subject, recipients=[email], body=body)
-    mail.send(msg)
+    queue_mail(message(subject, [email], body=body))
 
 # Helper function to update the password in the database
 def update_password(email, new_password):
-    db.execute("UPDATE users SET hash = ? WHERE mail = ?", generate_password_hash(new_password), email)
-
-# Helper function for getting Author id
-def get_author_id(author_name, country, birth):
-    # Check if the author already exists in the authors table
-    result = db.execute("SELECT id FROM authors WHERE name = ? AND country = ? AND birth = ?", titlecase(author_name), country, birth)
-
-    # If there is a result, return the existing author_id
-    if result:
-        return result[0]["id"]
+    db.execute("UPDATE users SET hash = ? WHERE mail = ?", passwords.hash(new_password), email)
+
+# Helper function to fetch one page of the shelf
+def shelf_page(size, after=None, before=None):
+    """
+    Return (rows, prev_cursor, next_cursor) for one page of books ordered by title.
+
+    Rows come straight from the catalog table through its (book_title, book_id)
+    index, with each book's authors already gathered into one column.
+    """
+    if before:
+        where, order = "WHERE (book_title, book_id) < (?, ?)", "DESC"
+        args = list(before)
+    elif after:
+        where, order = "WHERE (book_title, book_id) > (?, ?)", "ASC"
+        args = list(after)
     else:
-        # If the author doesn't exist, insert the new author
-        last_id = db.execute("INSERT INTO authors (name, country, birth) VALUES (?, ?, ?)", titlecase(author_name), country, birth)
-        
-        # Get the last inserted ID using lastrowid
-        return last_id
-    
+        where, order, args = "", "ASC", []
+
+    # Fetch one extra row to know whether there is another page in that direction
+    rows = unpack_authors(db.execute(
+        f"SELECT * FROM catalog {where} ORDER BY book_title {order}, book_id {order} LIMIT ?", *args, size + 1))
+
+    more = len(rows) > size
+    rows = rows[:size]
+    if before:
+        rows.reverse()
+
+    prev_cursor = next_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if after or (before and more):
+            prev_cursor = encode_cursor(first["book_title"], first["book_id"])
+        if before or more:
+            next_cursor = encode_cursor(last["book_title"], last["book_id"])
+    return rows, prev_cursor, next_cursor
+
+# Helper function to fetch the most read books
+def most_read(size, trending=False):
+    """
+    Return the size most read books, with their downloads and views.
+
+    Reads are counted all time from book_popularity, or with trending over
+    the last seven days of book_stats.
+    """
+    if trending:
+        # Read only the week's rows, even where grouping in primary key order looks cheaper
+        rows = db.execute("""
+            SELECT c.*, week.downloads, week.views
+            FROM (
+                SELECT book_id, SUM(downloads) AS downloads, SUM(views) AS views
+                FROM book_stats INDEXED BY book_stats_day WHERE day >= ? GROUP BY book_id
+                ORDER BY SUM(downloads + views) DESC, book_id LIMIT ?
+            ) week
+            CROSS JOIN catalog c ON c.book_id = week.book_id
+            ORDER BY week.downloads + week.views DESC, week.book_id
+        """, week_start(), size)
+    else:
+        rows = db.execute("""
+            SELECT c.*, p.downloads, p.views
+            FROM book_popularity p CROSS JOIN catalog c ON c.book_id = p.book_id
+            ORDER BY p.downloads + p.views DESC, p.book_id LIMIT ?
+        """, size)
+    return unpack_authors(rows)
+
+# Helper function to search the catalog
+def search_books(text):
+    """Return the best matching books for the search box text, best match first."""
+    query = match_query(text)
+    if not query:
+        return []
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    return unpack_authors(db.execute(f"""
+        SELECT c.* FROM (
+            SELECT rowid AS id, bm25(book_search, {weights}) AS score FROM book_search WHERE book_search MATCH ? ORDER BY score LIMIT ?
+        ) page
+        CROSS JOIN catalog c ON c.book_id = page.id
+        ORDER BY page.score, c.book_title
+        """, query, current_app.config["SEARCH_LIMIT"]))
+
+# Helper function to search the text inside books
+def search_pages(text):
+    """Return the best matching pages for text, with a highlighted snippet of each."""
+    query = match_query(text)
+    if not query:
+        return []
+    rows = db.execute("""
+        SELECT bp.book_id, bp.page, b.title AS book_title,
+            snippet(page_search, 0, ?, ?, '...', 16) AS snippet
+        FROM page_search
+        JOIN book_pages bp ON bp.id = page_search.rowid
+        JOIN books b ON b.id = bp.book_id
+        WHERE page_search MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        """, MARK_START, MARK_END, query, current_app.config["SEARCH_LIMIT"])
+    for row in rows:
+        row["snippet"] = highlight(row["snippet"], MARK_START, MARK_END)
+    return rows
+
+@bp.cli.command("rebuild-search")
+def rebuild_search():
+    """Refill the full-text search index from the catalog."""
+    count = rebuild_search_index(db)
+    print(f"Indexed {count} books")
+    cache.invalidate()
+
+@bp.cli.command("check-catalog")
+def check_catalog():
+    """Compare the catalog table with the tables it is built from and fail if they differ."""
+    drift = catalog_drift(db)
+    if drift:
+        print(f"{len(drift)} books differ from the catalog: {', '.join(map(str, drift))}")
+        print("Run 'flask rebuild-catalog' to fix them")
+        raise SystemExit(1)
+    print("Catalog is up to date")
+
+@bp.cli.command("rebuild-catalog")
+def rebuild_catalog_command():
+    """Refill the catalog table from books, authors, publishers and files."""
+    print(f"Catalogued {rebuild_catalog(db)} books")
+    cache.invalidate()
+
+@bp.cli.command("migrate")
+def migrate():
+    """Apply schema migrations the database has not seen yet."""
+    applied = db.migrate(current_app.config["MIGRATIONS_FOLDER"])
+    for name in applied:
+        print(f"Applied {name}")
+    if moved := recommendations.import_legacy():
+        print(f"Moved {moved} recommendations into the queue")
+    version = db.execute('SELECT MAX("version") AS version FROM "schema_version"')[0]["version"]
+    print(f"Schema is at version {version}")
+
+@bp.cli.command("send-mail")
+def send_mail():
+    """Send every message waiting in the outbox."""
+    print(f"Sent {send_pending()} messages")
+
+@bp.cli.command("make-thumbnails")
+def make_missing_thumbnails():
+    """Make shelf thumbnails for books uploaded before thumbnails existed."""
+    rows = db.execute("SELECT book_id, book_path, book_img_path FROM files WHERE thumb_key IS NULL")
+    for number, row in enumerate(rows, start=1):
+        cover_path = row["book_img_path"] if os.path.isfile(row["book_img_path"]) else None
+        try:
+            thumb_key = make_thumbnails(current_app.config["THUMBNAIL_FOLDER"], cover_path, row["book_path"])
+        except Exception as err:
+            print(f"[{number}/{len(rows)}] {row['book_path']}: {err}")
+            continue
+        db.execute("UPDATE files SET thumb_key = ? WHERE book_id = ?", thumb_key, row["book_id"])
+        print(f"[{number}/{len(rows)}] {row['book_path']}: {thumb_key}")
+
+@bp.cli.command("index-pages")
+@click.option("--all", "reindex", is_flag=True, help="Re-extract books that are already indexed.")
+def index_pages(reindex):
+    """Extract the page text of books already on the shelf into the search index."""
+    rows = db.execute("SELECT book_id, book_path FROM files" + ("" if reindex else " WHERE text_indexed = 0"))
+
+    for number, row in enumerate(rows, start=1):
+        try:
+            pages = index_book_pages(db, row["book_id"], row["book_path"])
+            print(f"[{number}/{len(rows)}] {row['book_path']}: {pages} pages")
+        except Exception as err:
+            print(f"[{number}/{len(rows)}] {row['book_path']}: {err}")
+
+@bp.cli.command("worker")
+@click.option("--threads", default=2, show_default=True, help="Jobs run at the same time.")
+@click.option("--once", is_flag=True, help="Run the jobs that are due now, then exit.")
+def worker(threads, once):
+    """Run background jobs: page counting, thumbnails, PDF optimization, text extraction, file cleanup and mail."""
+    if once:
+        print(f"Ran {run_pending()} jobs and sent {send_pending()} messages")
+    else:
+        print(f"Running jobs on {threads} threads and sending mail; press Ctrl+C to stop")
+        start_sender()
+        work(threads)
+
+@bp.cli.command("jobs")
+@click.option("--retry-failed", "retry", is_flag=True, help=f"Give jobs that failed {MAX_ATTEMPTS} times another round.")
+def jobs(retry):
+    """Show how many jobs are waiting, per kind of job."""
+    if retry:
+        print(f"Retrying {retry_failed()} jobs")
+    rows = depth()
+    print(f"{'job':<22} {'due':>6} {'later':>6} {'failed':>6}")
+    for row in rows:
+        print(f"{row['name']:<22} {row['due']:>6} {row['scheduled']:>6} {row['failed']:>6}")
+    if not rows:
+        print("No jobs waiting")
+
+@bp.cli.command("optimize-books")
+def optimize_books():
+    """Queue the optimization of book files stored before it existed."""
+    rows = db.execute("SELECT book_id FROM files WHERE stored_size IS NULL")
+    for row in rows:
+        enqueue("optimize_book", row["book_id"])
+    print(f"Queued {len(rows)} books; 'flask worker' or the web server's workers will optimize them")
+
+@bp.cli.command("pdf-sizes")
+def pdf_sizes():
+    """Show how much smaller the optimized book files are than the uploads."""
+    row = db.execute("""
+        SELECT COUNT(*) AS files, SUM(original_size) AS original, SUM(stored_size) AS stored,
+            SUM(stored_size < original_size) AS smaller
+        FROM (SELECT DISTINCT book_path, original_size, stored_size FROM files WHERE stored_size IS NOT NULL)
+    """)[0]
+    waiting = db.execute("SELECT COUNT(DISTINCT book_path) AS count FROM files WHERE stored_size IS NULL")[0]["count"]
+    if not row["files"]:
+        print(f"No optimized files yet; {waiting} waiting")
+        return
+    saved = row["original"] - row["stored"]
+    print(f"{row['files']} files, {row['smaller']} made smaller: {row['original'] / 2**20:.1f} MiB uploaded, "
+          f"{row['stored'] / 2**20:.1f} MiB stored, {saved / 2**20:.1f} MiB ({saved / row['original']:.0%}) saved "
+          f"on every full download; {waiting} files waiting")
+
+@bp.cli.command("collect-orphans")
+def collect_orphans_command():
+    """Delete stored files that no book refers to any more."""
+    print(f"Removed {collect_orphans()} files")
+
+@bp.cli.command("import-books")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--pdf-dir", type=click.Path(exists=True, file_okay=False), help="Folder the manifest's file paths are relative to.")
+@click.option("--batch-size", default=100, show_default=True, help="Books committed per transaction.")
+@click.option("--workers", type=int, help="Processes inspecting PDFs; defaults to one per CPU.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of an earlier run.")
+def import_books_command(manifest, pdf_dir, batch_size, workers, restart):
+    """Add the books listed in a CSV or JSON manifest, resuming an interrupted import."""
+    folders = (current_app.config["UPLOAD_FOLDER"], current_app.config["UPLOAD_IMG_FOLDER"], current_app.config["THUMBNAIL_FOLDER"])
+    counts = import_books(db, manifest, pdf_dir or os.path.dirname(os.path.abspath(manifest)), folders,
+                          batch_size=batch_size, workers=workers, restart=restart)
+    print(f"Imported {counts['imported']} books, skipped {counts['skipped']}, failed {counts['failed']}")
+    # Reaches running servers through the shared cache tier; local tiers expire after CACHE_TTL
+    cache.invalidate()
+    if counts["imported"]:
+        print("Run 'flask index-pages' to make their pages searchable and 'flask optimize-books' to shrink their files")
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
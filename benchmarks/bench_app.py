@@ -0,0 +1,129 @@
+"""
+Microbenchmarks of the shelf, search, addbook and login paths.
+
+    pip install -r benchmarks/requirements.txt
+    python -m pytest benchmarks/bench_app.py --benchmark-autosave
+    python -m pytest benchmarks/bench_app.py --benchmark-compare          # against the last saved run
+    pytest-benchmark compare 0001 0002 --group-by=name                    # any two saved runs
+
+Runs against a library built by generate_catalog.py with BENCH_BOOKS books
+(default 5000) in a temporary folder. Saved runs land in .benchmarks/ and
+carry the commit they were made on. The file is named bench_*.py so that a
+plain "pytest" run does not pick it up.
+"""
+
+
+import io
+import itertools
+import os
+import sys
+
+import pytest
+from flask import current_app
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_catalog import PASSWORD, isbn13  # noqa: E402
+from library_app import served_library  # noqa: E402
+
+
+BOOKS = int(os.getenv("BENCH_BOOKS", 5000))
+
+
+@pytest.fixture(scope="session")
+def library(tmp_path_factory):
+    """The app module, serving a generated library from a temporary working directory, in an app context."""
+    with served_library(
+        tmp_path_factory.mktemp("library"), books=BOOKS, authors=max(BOOKS // 3, 1), users=20, page_text=True,
+    ) as app:
+        yield app
+
+
+@pytest.fixture(scope="session")
+def admin(library):
+    """A test client signed in as the admin."""
+    client = current_app.test_client()
+    assert client.post("/login", data={"username": "admin", "password": PASSWORD}).status_code == 302
+    return client
+
+
+@pytest.fixture(scope="session")
+def pdf(library):
+    with open(library.db.execute("SELECT book_path FROM files LIMIT 1")[0]["book_path"], "rb") as f:
+        return f.read()
+
+
+def test_shelf_first_page(benchmark, library):
+    rows, _, _ = benchmark(library.shelf_page, 24)
+    assert len(rows) == 24
+
+
+def test_shelf_middle_page(benchmark, library):
+    middle = library.db.execute(
+        "SELECT book_title, book_id FROM catalog ORDER BY book_title, book_id LIMIT 1 OFFSET ?", BOOKS // 2)[0]
+    rows, _, _ = benchmark(library.shelf_page, 24, after=(middle["book_title"], middle["book_id"]))
+    assert len(rows) == 24
+
+
+def test_shelf_request(benchmark, library, admin):
+    def uncached():
+        library.cache.invalidate()
+        return admin.get("/shelf")
+    assert benchmark(uncached).status_code == 200
+
+
+def test_shelf_request_cached(benchmark, admin):
+    assert benchmark(admin.get, "/shelf").status_code == 200
+
+
+@pytest.mark.parametrize("text", ["river", "ada achebe", "harvest map", isbn13(42)])
+def test_search(benchmark, library, text):
+    assert benchmark(library.search_books, text)
+
+
+def test_search_request(benchmark, library, admin):
+    def uncached():
+        library.cache.invalidate()
+        return admin.post("/shelf", data={"search": "garden"})
+    assert benchmark(uncached).status_code == 200
+
+
+def test_search_pages(benchmark, library):
+    assert benchmark(library.search_pages, "lantern harbour")
+
+
+def test_addbook(benchmark, library, admin, pdf):
+    isbns = itertools.count(BOOKS + 1)
+
+    def form():
+        return ("/addbook",), {"data": {
+            "title": "A Benchmark Book", "publisher": "Bench Press", "year": "2024", "isbn": isbn13(next(isbns)),
+            "author": "Ada Obi, Wole Soyinka", "country": "Nigeria, Nigeria", "birth": "1970-01-01, 1934-07-13",
+            "pdf_file": (io.BytesIO(pdf), "book.pdf"),
+        }, "content_type": "multipart/form-data"}
+
+    response = benchmark.pedantic(admin.post, setup=form, rounds=30)
+    assert response.status_code == 302
+
+
+def test_addbook_jobs(benchmark, library, admin, pdf):
+    """Page counting, thumbnails and text indexing that addbook leaves to the job worker."""
+    isbns = itertools.count(BOOKS + 1000)
+
+    def queue_book():
+        admin.post("/addbook", content_type="multipart/form-data", data={
+            "title": "A Queued Book", "publisher": "Bench Press", "year": "2024", "isbn": isbn13(next(isbns)),
+            "author": "Ama Aidoo", "country": "Ghana", "birth": "1942-03-23",
+            "pdf_file": (io.BytesIO(pdf), "book.pdf"),
+        })
+
+    ran = benchmark.pedantic(library.run_pending, setup=queue_book, rounds=10)
+    assert ran >= 2
+
+
+def test_login(benchmark, library):
+    client = current_app.test_client()
+    response = benchmark.pedantic(
+        client.post, args=("/login",), kwargs={"data": {"username": "reader2", "password": PASSWORD}}, rounds=20)
+    assert response.status_code == 302
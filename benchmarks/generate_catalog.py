@@ -0,0 +1,174 @@
+"""
+Build a synthetic library for benchmarks and load tests.
+
+    python benchmarks/generate_catalog.py FOLDER [--books 5000] [--authors 1500] [--users 100]
+                                                 [--pdfs 20] [--pages 8] [--page-text] [--seed 1]
+
+FOLDER gets a library.db made from lib.sql and migrations/, plus the dummy
+PDFs and their thumbnails under static/files/, laid out as the app keeps
+them. Run the app with FOLDER as its working directory and DATABASE set to
+library.db. The same arguments always build the same library, so runs on
+different commits compare like with like.
+
+Books share --pdfs distinct files of --pages pages each. Every user signs
+in with --password: "admin" (user 1, an admin) and reader2, reader3, ...
+"""
+
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+import fitz
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from covers import THUMBNAIL_WIDTHS, make_thumbnails, thumbnail_name  # noqa: E402
+from database import Database  # noqa: E402
+
+
+PASSWORD = "Benchmark-Pass-2024"
+
+WORDS = (
+    "river", "night", "garden", "stone", "empire", "silence", "harvest", "letter", "shadow", "market",
+    "bridge", "winter", "orchard", "fire", "kingdom", "voyage", "mirror", "journey", "thunder", "city",
+    "daughter", "memory", "forest", "ocean", "lantern", "promise", "season", "island", "drum", "village",
+    "history", "machine", "language", "science", "freedom", "map", "song", "road", "harbour", "desert",
+)
+FIRST_NAMES = (
+    "Ada", "Chinua", "Wole", "Toni", "Ngugi", "Chimamanda", "James", "Zadie", "Arundhati", "Salman",
+    "Margaret", "Alice", "Yaa", "Teju", "Ben", "Buchi", "Nadine", "Ama", "Jhumpa", "Haruki",
+)
+LAST_NAMES = (
+    "Obi", "Achebe", "Soyinka", "Morrison", "Thiong'o", "Adichie", "Baldwin", "Smith", "Roy", "Rushdie",
+    "Atwood", "Munro", "Gyasi", "Cole", "Okri", "Emecheta", "Gordimer", "Aidoo", "Lahiri", "Murakami",
+)
+COUNTRIES = ("Nigeria", "United States", "Canada", "United Kingdom", "India", "Ghana", "Kenya", "Japan")
+
+
+def isbn13(number):
+    """A valid ISBN-13 in the 978 range for a running number."""
+    digits = f"978{number:09d}"
+    check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_pdf(folder, pages, rng):
+    """Write a PDF of pages pages of filler text into folder under its SHA-256; returns (path, sha256, texts)."""
+    texts = [" ".join(sentence(rng, rng.randint(6, 14)) for _ in range(40)) for _ in range(pages)]
+    with fitz.open() as document:
+        for text in texts:
+            page = document.new_page()
+            page.insert_textbox(fitz.Rect(72, 72, page.rect.width - 72, page.rect.height - 72), text, fontsize=11)
+        data = document.tobytes(garbage=3, deflate=True)
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = os.path.join(folder, f"{sha256}.pdf")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, sha256, texts
+
+
+def generate(folder, books=5000, authors=1500, users=100, pdfs=20, pages=8, page_text=False, seed=1,
+             password=PASSWORD, report=print):
+    """Build the library described in the module docstring in folder; returns the path of its database."""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "library.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    db = Database(path)
+    with open(os.path.join(ROOT, "lib.sql")) as f:
+        db.executescript(f.read())
+    db.migrate(os.path.join(ROOT, "migrations"))
+
+    # Paths are stored relative to folder, as the app stores them relative to its working directory
+    book_folder = os.path.join("static", "files", "books")
+    thumb_folder = os.path.join("static", "files", "book_covers", "thumbs")
+    os.makedirs(os.path.join(folder, book_folder), exist_ok=True)
+    files = []
+    for _ in range(pdfs):
+        pdf_path, sha256, texts = make_pdf(os.path.join(folder, book_folder), pages, rng)
+        thumb_key = make_thumbnails(os.path.join(folder, thumb_folder), None, pdf_path)
+        files.append((
+            os.path.join(book_folder, os.path.basename(pdf_path)),
+            os.path.join(thumb_folder, thumbnail_name(thumb_key, max(THUMBNAIL_WIDTHS))),
+            sha256, thumb_key, texts,
+        ))
+
+    # One hash for everyone; deriving a key per user would dominate the run
+    pwhash = generate_password_hash(password, os.getenv("PASSWORD_METHOD", "scrypt:32768:8:1"))
+
+    publishers = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} Press" for _ in range(max(books // 25, 1))]
+    people = {}
+    while len(people) < authors:
+        person = (f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", rng.choice(COUNTRIES),
+                  f"{rng.randint(1900, 2000)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+        people.setdefault(person, len(people) + 1)
+
+    with db.transaction():
+        db.executemany(
+            "INSERT INTO users (id, name, username, mail, hash) VALUES (?, ?, ?, ?, ?)",
+            [(1, "Admin", "admin", "admin@example.com", pwhash)] + [
+                (i, f"Reader {i}", f"reader{i}", f"reader{i}@example.com", pwhash) for i in range(2, users + 1)],
+        )
+        db.execute("INSERT INTO admins (user_id) VALUES (1)")
+        db.executemany("INSERT INTO publishers (id, publisher) VALUES (?, ?)",
+                       list(enumerate(dict.fromkeys(publishers), 1)))
+        db.executemany("INSERT INTO authors (id, name, country, birth) VALUES (?, ?, ?, ?)",
+                       [(author_id, *person) for person, author_id in people.items()])
+
+        publisher_count = len(dict.fromkeys(publishers))
+        for book_id in range(1, books + 1):
+            book_path, img_path, sha256, thumb_key, texts = files[book_id % len(files)]
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+            db.execute(
+                "INSERT INTO books (id, isbn, title, year, publisher_id, pages) VALUES (?, ?, ?, ?, ?, ?)",
+                book_id, isbn13(book_id), title, rng.randint(1950, 2024), rng.randint(1, publisher_count), pages,
+            )
+            db.execute(
+                "INSERT INTO files (book_id, book_path, book_img_path, text_indexed, sha256, thumb_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                book_id, book_path, img_path, int(page_text), sha256, thumb_key,
+            )
+            db.executemany("INSERT INTO authored (author_id, book_id) VALUES (?, ?)",
+                           [(author_id, book_id) for author_id in rng.sample(range(1, authors + 1), rng.randint(1, 3))])
+            if page_text:
+                db.executemany('INSERT INTO "book_pages" ("book_id", "page", "text") VALUES (?, ?, ?)',
+                               [(book_id, page, text) for page, text in enumerate(texts, 1)])
+
+    db.execute("ANALYZE")
+    report(f"{books} books by {authors} authors, {users} users and {pdfs} PDFs in {folder} "
+           f"({time.perf_counter() - started:.1f}s)")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder")
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--authors", type=int, default=1500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--pdfs", type=int, default=20, help="distinct PDF files shared by the books")
+    parser.add_argument("--pages", type=int, default=8, help="pages in each PDF")
+    parser.add_argument("--page-text", action="store_true", help="index the text of every book's pages")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default=PASSWORD)
+    args = parser.parse_args()
+    generate(args.folder, args.books, args.authors, args.users, args.pdfs, args.pages, args.page_text,
+             args.seed, args.password)
+
+
+if __name__ == "__main__":
+    main()
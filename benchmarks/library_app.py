@@ -0,0 +1,49 @@
+"""
+The app serving a generated library, as the tests and the benchmarks use it.
+
+    with served_library(folder, books=60) as app:
+        app.shelf_page(24)
+"""
+
+
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_catalog import generate  # noqa: E402
+
+
+@contextmanager
+def served_library(folder, statistics=True, **options):
+    """
+    Generate a library in folder (a pathlib.Path) with options for generate(),
+    and yield the app module serving it, in an app context.
+
+    The working directory is folder meanwhile. Jobs run only when asked for and
+    logins are never rate limited. Without statistics the ANALYZE results are
+    dropped, so that SQLite plans queries on a few rows as it would for a full
+    library instead of scanning tables that fit in one page.
+    """
+    generate(str(folder), **options)
+    if not statistics:
+        with sqlite3.connect(folder / "library.db") as connection:
+            connection.execute("DROP TABLE IF EXISTS sqlite_stat1")
+        connection.close()
+
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        import app
+
+        flask_app = app.create_app({
+            "DATABASE": str(folder / "library.db"), "AUTO_MIGRATE": False, "TASK_WORKERS": 0, "CACHE_URL": "",
+            "LOGIN_BURST": 1000000, "LOGIN_IP_BURST": 1000000, "TESTING": True, "WTF_CSRF_ENABLED": False,
+        })
+        with flask_app.app_context():
+            yield app
+    finally:
+        os.chdir(cwd)
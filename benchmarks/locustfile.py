@@ -0,0 +1,67 @@
+"""
+Load test of a running library server with Locust.
+
+    python benchmarks/generate_catalog.py /tmp/library --books 5000 --page-text
+    cd /tmp/library && DATABASE=library.db LOGIN_IP_BURST=100000 flask --app /path/to/app.py run
+    locust -f benchmarks/locustfile.py --host http://127.0.0.1:5000 --headless \
+        -u 50 -r 10 -t 2m --csv results/$(git rev-parse --short HEAD)
+
+Each simulated reader signs in as one of the generated readers (BENCH_USERS,
+default 100, must match --users) and then pages through the shelf, searches
+the catalog and the text of books, and downloads books. The CSV files named
+after the commit can be compared across commits.
+"""
+
+
+import os
+import random
+import re
+
+from locust import HttpUser, between, task
+
+
+PASSWORD = os.getenv("BENCH_PASSWORD", "Benchmark-Pass-2024")
+BOOKS = int(os.getenv("BENCH_BOOKS", 5000))
+USERS = int(os.getenv("BENCH_USERS", 100))
+WORDS = ("river", "garden", "harvest", "lantern", "island", "memory", "thunder", "voyage", "achebe", "adichie")
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" value\s*=\s*"([^"]+)"')
+NEXT_PAGE = re.compile(r'href="[^"]*[?&]after=([\w-]+)')
+
+
+class Reader(HttpUser):
+    wait_time = between(0.5, 2)
+
+    def on_start(self):
+        page = self.client.get("/login").text
+        self.client.post("/login", data={
+            "username": f"reader{random.randint(2, USERS)}",
+            "password": PASSWORD,
+            "csrf_token": CSRF_TOKEN.search(page).group(1),
+        })
+        # Signing in starts a new session, and with it a new CSRF token
+        self.csrf_token = CSRF_TOKEN.search(self.client.get("/shelf").text).group(1)
+        self.next_cursor = None
+
+    @task(5)
+    def browse_shelf(self):
+        # Keep paging forward, starting over at the end of the shelf
+        if self.next_cursor:
+            page = self.client.get(f"/shelf?after={self.next_cursor}", name="/shelf?after=[cursor]").text
+        else:
+            page = self.client.get("/shelf").text
+        match = NEXT_PAGE.search(page)
+        self.next_cursor = match.group(1) if match else None
+
+    @task(3)
+    def search_catalog(self):
+        text = " ".join(random.sample(WORDS, random.randint(1, 2)))
+        self.client.post("/shelf", data={"search": text, "csrf_token": self.csrf_token}, name="/shelf [search]")
+
+    @task(1)
+    def search_inside(self):
+        self.client.get(f"/search/pages?q={random.choice(WORDS)}", name="/search/pages")
+
+    @task(1)
+    def download_book(self):
+        self.client.get(f"/books/{random.randint(1, BOOKS)}/download", name="/books/[id]/download")
@@ -0,0 +1,111 @@
+"""
+Compare the per-request cost of loading and saving a session with each backend.
+
+    python benchmarks/session_backends.py [--requests 2000] [--redis-url redis://localhost:6379/15]
+
+Backends that cannot run here (no Flask-Session, no Redis server and no
+fakeredis) are skipped. Each backend is timed for a request that only reads
+the session and for one that changes it, with a payload like the one the
+library keeps for a signed-in user.
+"""
+
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask, session
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database  # noqa: E402
+from sessions import RedisSessionStore, ServerSessionInterface, SQLiteSessionStore  # noqa: E402
+
+
+PAYLOAD = {
+    "user_id": 42,
+    "name": "Ada Obi",
+    "username": "ada",
+    "is_admin": True,
+    "roles_version": 7,
+    "csrf_token": "0f" * 20,
+}
+
+
+def backends(folder, redis_url):
+    """Yield (name, session interface) for every backend available here."""
+    yield "cookie", None
+
+    try:
+        from flask_session.sessions import FileSystemSessionInterface
+        yield "filesystem", FileSystemSessionInterface(os.path.join(folder, "fs"), 500, 0o600, "session:")
+    except ImportError:
+        print("filesystem: skipped, Flask-Session is not installed")
+
+    db = Database(os.path.join(folder, "sessions.db"))
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "migrations", "0011_sessions.sql")) as f:
+        db.executescript(f.read())
+    yield "sqlite", ServerSessionInterface(SQLiteSessionStore(db))
+
+    client = None
+    if redis_url:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        label = "redis"
+    else:
+        try:
+            import fakeredis
+            client, label = fakeredis.FakeRedis(), "redis (fakeredis)"
+        except ImportError:
+            print("redis: skipped, pass --redis-url or install fakeredis")
+    if client is not None:
+        yield label, ServerSessionInterface(RedisSessionStore(client=client))
+
+
+def measure(interface, requests):
+    """Return microseconds per read-only request and per request that writes."""
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    if interface is not None:
+        app.session_interface = interface
+
+    @app.route("/read")
+    def read():
+        return str(session.get("user_id"))
+
+    @app.route("/write")
+    def write():
+        session["hits"] = session.get("hits", 0) + 1
+        return ""
+
+    client = app.test_client()
+    with client.session_transaction() as new:
+        new.update(PAYLOAD)
+
+    timings = []
+    for path in ("/read", "/write"):
+        client.get(path)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        timings.append((time.perf_counter() - start) / requests * 1e6)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--redis-url", help="Redis server to measure; its keys are left to expire")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'backend':<20} {'read us/req':>12} {'write us/req':>13}")
+        for name, interface in backends(folder, args.redis_url):
+            read, write = measure(interface, args.requests)
+            print(f"{name:<20} {read:>12.1f} {write:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure how long a worker takes to boot and how much memory it holds.
+
+    python benchmarks/startup.py [--runs 5] [--top 15] [--budget-ms 800]
+
+Each run starts a fresh interpreter with -X importtime that imports app,
+calls create_app() on a small generated library and answers GET /login,
+as a new web worker would. Reported are the medians of the time spent
+importing, in create_app() and in that first request, the peak resident
+memory, the modules app imports that are slowest to load, and which of the
+heavy modules only the upload and ingest paths need (PyMuPDF, pycountry,
+password_strength, Flask-Mail) were loaded anyway. With --budget-ms the
+script fails when importing plus create_app() takes longer than that.
+"""
+
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_catalog import generate  # noqa: E402
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules that only adding books, sending mail or registering should load
+HEAVY = ("fitz", "pycountry", "password_strength", "flask_mail")
+
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app({"DATABASE": "library.db", "TASK_WORKERS": 0, "CACHE_URL": ""})
+created = time.perf_counter()
+assert flask_app.test_client().get("/login").status_code == 200
+answered = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": created - imported,
+    "first_request": answered - created,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY,)
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative microseconds} for the modules app imports itself."""
+    direct, inside_app = {}, False
+    for line in reversed(stderr.splitlines()):
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            # Lines come out children first, so reading backwards meets app before its imports
+            inside_app = name.strip() == "app"
+        elif inside_app and depth == 1:
+            direct[name.strip()] = int(cumulative)
+    return direct
+
+
+def run(folder):
+    """Boot one worker in folder; returns its measurements and import times."""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd=folder, env=env, capture_output=True, text=True, check=False,
+    )
+    if result.returncode:
+        sys.exit(result.stderr[-2000:])
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports of app to list")
+    parser.add_argument("--budget-ms", type=float, help="fail if importing and create_app() take longer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        generate(folder, books=50, authors=20, users=2, pdfs=1, pages=1)
+        # The first run fills the bytecode cache, as a deployed worker would find it
+        run(folder)
+        runs = [run(folder) for _ in range(args.runs)]
+
+    timings = [timing for timing, _ in runs]
+    median = {key: statistics.median(timing[key] for timing in timings) * 1000
+              for key in ("import", "create_app", "first_request")}
+    print(f"{'import app':<22} {median['import']:>8.1f} ms")
+    print(f"{'create_app()':<22} {median['create_app']:>8.1f} ms")
+    print(f"{'first request':<22} {median['first_request']:>8.1f} ms")
+    print(f"{'peak RSS':<22} {statistics.median(t['rss_kb'] for t in timings) / 1024:>8.1f} MB")
+    heavy = sorted({name for timing in timings for name in timing["heavy"]})
+    print(f"heavy modules loaded at startup: {', '.join(heavy) or 'none'}")
+
+    imports = {name: statistics.median(times.get(name, 0) for _, times in runs) for name in runs[0][1]}
+    print("\nslowest imports of app (cumulative ms, shared dependencies count once):")
+    for name, microseconds in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28} {microseconds / 1000:>8.1f}")
+
+    boot = median["import"] + median["create_app"]
+    if args.budget_ms is not None and boot > args.budget_ms:
+        sys.exit(f"\nbooting took {boot:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Adding books to the library catalog
+
+
+import sqlite3
+
+from helpers import clean_user_input, list_to_string, titlecase
+
+
+class DuplicateBook(ValueError):
+    """A book with the same ISBN is already on the shelf."""
+
+
+def parse_authors(names, countries, births):
+    """
+    Pair up comma separated author names, countries and birthdates.
+
+    Countries are matched to their pycountry name. Returns a list of
+    (name, country, birth) tuples, one per author.
+    """
+    names, countries, births = list_to_string(names), list_to_string(countries), list_to_string(births)
+    if not len(names) == len(countries) == len(births):
+        raise ValueError("Each author needs a country and a birthdate")
+    return [(titlecase(name), clean_user_input(country), birth) for name, country, birth in zip(names, countries, births)]
+
+
+def isbn_exists(db, isbn):
+    return bool(db.execute("SELECT 1 FROM books WHERE isbn = ?", isbn))
+
+
+def insert_book(db, title, isbn, year, publisher, authors, pages, book_path, book_img_path, sha256=None, thumb_key=None):
+    """
+    Add a book, its publisher, authors and files in one transaction.
+
+    Publishers and authors are found or created with a single UPSERT each,
+    and the authored links are written in one batch. Raises DuplicateBook if
+    the ISBN is taken; nothing is written if anything fails. Returns the id
+    of the new book.
+    """
+    with db.transaction():
+        publisher_id = db.execute(
+            "INSERT INTO publishers (publisher) VALUES (?) "
+            "ON CONFLICT (publisher) DO UPDATE SET publisher = excluded.publisher RETURNING id",
+            titlecase(publisher),
+        )[0]["id"]
+
+        try:
+            book_id = db.execute(
+                "INSERT INTO books (isbn, title, year, publisher_id, pages) VALUES (?, ?, ?, ?, ?)",
+                isbn, titlecase(title), year, publisher_id, pages,
+            )
+        except sqlite3.IntegrityError:
+            raise DuplicateBook(isbn) from None
+
+        db.execute(
+            "INSERT INTO files (book_id, book_path, book_img_path, sha256, thumb_key) VALUES (?, ?, ?, ?, ?)",
+            book_id, book_path, book_img_path, sha256, thumb_key,
+        )
+
+        author_ids = []
+        for name, country, birth in authors:
+            author_ids.append(db.execute(
+                "INSERT INTO authors (name, country, birth) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, country, birth) DO UPDATE SET name = excluded.name RETURNING id",
+                name, country, birth,
+            )[0]["id"])
+
+        # The same author listed twice is still one authorship
+        db.executemany(
+            "INSERT INTO authored (author_id, book_id) VALUES (?, ?)",
+            [(author_id, book_id) for author_id in dict.fromkeys(author_ids)],
+        )
+    return book_id
@@ -0,0 +1,170 @@
+# Caching of shelf pages and search results
+
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe in-process cache that forgets the least recently used entry when full."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache:
+    """
+    A cache shared by the processes of one machine, kept as JSON files in a folder.
+
+    It also stands in for Redis when developing. The generation file records
+    the last invalidation, so every process sees it on its next lookup.
+    """
+
+    def __init__(self, folder, ttl):
+        self.folder = folder
+        self.ttl = ttl
+        os.makedirs(folder, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                expires, value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return value if expires > time.time() else None
+
+    def set(self, key, value):
+        self._write(self._path(key), json.dumps([time.time() + self.ttl, value]))
+
+    def generation(self):
+        try:
+            with open(os.path.join(self.folder, "generation")) as f:
+                return f.read()
+        except OSError:
+            return "0"
+
+    def invalidate(self):
+        # Old entries are never read again once their keys' generation has moved on
+        self._write(os.path.join(self.folder, "generation"), str(time.time_ns()))
+        for name in os.listdir(self.folder):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _write(self, path, text):
+        # Write then rename, so readers never see half a file
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+
+class RedisCache:
+    """A cache shared by every process that can reach a Redis (or Redis-compatible) server."""
+
+    def __init__(self, url, ttl, prefix="library:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// CACHE_URL needs the redis package (pip install redis)") from None
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def generation(self):
+        value = self.client.get(self.prefix + "generation")
+        return "0" if value is None else value.decode()
+
+    def invalidate(self):
+        self.client.incr(self.prefix + "generation")
+
+
+def shared_cache(url, ttl):
+    """Build the shared tier named by a CACHE_URL: empty, file://folder, file:///folder or redis://host."""
+    if not url:
+        return None
+    if url.startswith("file://"):
+        return FileCache(url[len("file://"):], ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url, ttl)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+class ResultCache:
+    """
+    Two-tier cache of query results: an LRU in this process in front of a
+    tier shared with other processes. Without the shared tier, invalidate()
+    only reaches this process, so other workers would keep serving stale
+    results for up to ttl seconds; run a single process then.
+
+    Keys are prefixed with a generation that invalidate() moves on, so a write
+    to the catalog makes every earlier entry unreachable at once. Entries of
+    the local tier also expire after ttl seconds. Values must survive a trip
+    through JSON to be shared.
+    """
+
+    def __init__(self, maxsize=256, ttl=300, shared=None):
+        self.ttl = ttl
+        self.shared = shared
+        self.local = LRUCache(maxsize)
+        self._generation = 0
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for key, calling compute() to fill it on a miss."""
+        generation = self.shared.generation() if self.shared else self._generation
+        key = f"{generation}:{key}"
+
+        entry = self.local.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+
+        value = self.shared.get(key) if self.shared else None
+        if value is None:
+            value = compute()
+            if self.shared:
+                self.shared.set(key, value)
+        self.local.set(key, (time.time() + self.ttl, value))
+        return value
+
+    def invalidate(self):
+        """Forget every cached result, here and in the shared tier."""
+        self._generation += 1
+        self.local.clear()
+        if self.shared:
+            self.shared.invalidate()
@@ -0,0 +1,51 @@
+# Denormalized catalog of the books on the shelf
+
+
+import json
+
+
+# What every catalog row should hold, computed from the normalized tables.
+# The triggers in migrations/0009_catalog.sql keep the catalog table equal to this.
+EXPECTED = """
+SELECT b.id AS book_id, b.isbn, b.title AS book_title, b.year AS book_year,
+    p.publisher AS publisher_name, b.pages, b.date_uploaded,
+    f.book_path, f.book_img_path, f.thumb_key,
+    (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+        SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+        WHERE au.book_id = b.id ORDER BY au.rowid)) AS authors
+FROM books b
+LEFT JOIN publishers p ON p.id = b.publisher_id
+LEFT JOIN files f ON f.book_id = b.id
+GROUP BY b.id
+"""
+
+COLUMNS = """
+    "book_id", "isbn", "book_title", "book_year", "publisher_name", "pages", "date_uploaded",
+    "book_path", "book_img_path", "thumb_key", "authors"
+"""
+
+
+def catalog_drift(db):
+    """Return the ids of books whose catalog row is missing, stale or left over."""
+    rows = db.execute(f"""
+        SELECT book_id FROM (SELECT * FROM ({EXPECTED}) EXCEPT SELECT {COLUMNS} FROM "catalog")
+        UNION
+        SELECT book_id FROM (SELECT {COLUMNS} FROM "catalog" EXCEPT SELECT * FROM ({EXPECTED}))
+        ORDER BY book_id
+    """)
+    return [row["book_id"] for row in rows]
+
+
+def rebuild_catalog(db):
+    """Refill the catalog from the normalized tables; returns the number of books."""
+    with db.transaction():
+        db.execute('DELETE FROM "catalog"')
+        db.execute(f'INSERT INTO "catalog" ({COLUMNS}) {EXPECTED}')
+        return db.execute('SELECT COUNT(*) AS n FROM "catalog"')[0]["n"]
+
+
+def unpack_authors(rows):
+    """Turn the authors JSON of catalog rows into lists of dicts, in place."""
+    for row in rows:
+        row["authors"] = json.loads(row["authors"])
+    return rows
@@ -0,0 +1,73 @@
+# Cover thumbnails for the library program
+
+
+import hashlib
+import os
+
+from metrics import span
+
+
+# Widths, in pixels, of the thumbnails made for every cover
+THUMBNAIL_WIDTHS = (160, 320, 640)
+
+# JPEG quality used for thumbnails
+THUMBNAIL_QUALITY = 80
+
+
+def thumbnail_name(key, width):
+    """File name of the thumbnail of a given width for a cover key."""
+    return f"{key}-{width}.jpg"
+
+
+def make_thumbnails(folder, cover_path=None, pdf_path=None):
+    """
+    Write a JPEG thumbnail of every THUMBNAIL_WIDTHS size into folder.
+
+    The source is the uploaded cover image or, when there is none, page 1 of
+    the book rendered through PyMuPDF. Thumbnails are named after a hash of
+    the source so identical covers share files and their URLs never change
+    content. Returns the key used in the thumbnail names.
+    """
+    # Loaded here rather than at startup, as only the jobs render thumbnails
+    import fitz
+
+    if cover_path:
+        with open(cover_path, "rb") as f:
+            key = hashlib.sha256(f.read()).hexdigest()[:20]
+        source = fitz.Pixmap(cover_path)
+    else:
+        with span("pdf_cover"), fitz.open(pdf_path) as document:
+            first_page = document[0]
+            # Render page 1 just wide enough for the largest thumbnail
+            scale = max(THUMBNAIL_WIDTHS) / first_page.rect.width
+            source = first_page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        key = hashlib.sha256(source.samples).hexdigest()[:20]
+
+    # JPEG holds neither transparency nor unusual colorspaces
+    if source.alpha:
+        source = fitz.Pixmap(source, 0)
+    if source.colorspace and source.colorspace.n not in (1, 3):
+        source = fitz.Pixmap(fitz.csRGB, source)
+
+    os.makedirs(folder, exist_ok=True)
+    for width in THUMBNAIL_WIDTHS:
+        path = os.path.join(folder, thumbnail_name(key, width))
+        if os.path.exists(path):
+            continue
+        width = min(width, source.width)
+        height = max(1, round(source.height * width / source.width))
+        fitz.Pixmap(source, width, height, None).save(path, jpg_quality=THUMBNAIL_QUALITY)
+    return key
+
+
+def remove_thumbnails(folder, key):
+    """Delete every thumbnail made for a cover key."""
+    for width in THUMBNAIL_WIDTHS:
+        path = os.path.join(folder, thumbnail_name(key, width))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def srcset(key, url):
+    """Build an <img srcset> value for a cover key, given a url(name) function."""
+    return ", ".join(f"{url(thumbnail_name(key, width))} {width}w" for width in THUMBNAIL_WIDTHS)
@@ -0,0 +1,292 @@
+# Database access for the library program
+
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# SQLite has no ALTER TABLE ... ADD COLUMN IF NOT EXISTS; migrations may use
+# it anyway, for columns that older databases already have
+ADD_COLUMN = re.compile(r'ALTER\s+TABLE\s+"(\w+)"\s+ADD\s+COLUMN\s+IF\s+NOT\s+EXISTS\s+"(\w+)"([^;]*);', re.IGNORECASE)
+
+
+class Database:
+    """
+    Thread-safe, pooled access to an SQLite database.
+
+    execute() answers like cs50.SQL did: a list of dicts for statements that
+    return rows (SELECT, PRAGMA, ... RETURNING), the new row id for INSERT and
+    the number of rows changed for UPDATE and DELETE. Every pooled connection
+    runs in WAL mode with foreign keys on and keeps its own cache of prepared
+    statements, so repeated queries are not parsed again.
+
+    on_query, if set, is called with the text, duration in seconds and
+    parameters of every statement run, whether it succeeded or not; scripts
+    report no parameters and executemany() those of its first row.
+    """
+
+    def __init__(self, path, pool_size=8, busy_timeout=5000, cache_size=-20000,
+                 mmap_size=256 * 1024 * 1024, cached_statements=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._local = threading.local()
+        self.on_query = None
+
+        # WAL is stored in the database file, so setting it once is enough
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+
+    def execute(self, sql, *args):
+        """Run one statement, inside this thread's transaction if one is open."""
+        command = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+        # Keep supporting explicit BEGIN/COMMIT/ROLLBACK from callers
+        if command == "BEGIN":
+            with self._timed(sql):
+                self._begin()
+            return None
+        if command in ("COMMIT", "END", "ROLLBACK"):
+            with self._timed(sql):
+                self._finish(command == "ROLLBACK")
+            return None
+
+        with self._connection() as connection, self._timed(sql, args):
+            cursor = connection.execute(sql, args)
+            if cursor.description is not None:
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            if command in ("INSERT", "REPLACE"):
+                return cursor.lastrowid
+            return cursor.rowcount
+
+    def executemany(self, sql, rows):
+        """Run one statement for every tuple of parameters in rows."""
+        first = rows[0] if isinstance(rows, (list, tuple)) and rows else ()
+        with self._connection() as connection, self._timed(sql, first):
+            return connection.executemany(sql, rows).rowcount
+
+    def executescript(self, sql):
+        """Run several statements at once, e.g. schema definitions; not allowed in a transaction."""
+        if getattr(self._local, "connection", None) is not None:
+            raise RuntimeError("executescript() cannot run inside a transaction")
+        with self._connection() as connection, self._timed(sql):
+            connection.executescript(sql)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the statements of a with-block in one transaction.
+
+        The transaction takes the write lock up front, commits when the block
+        ends and rolls back if it raises. Nested blocks join the outer one.
+        """
+        if getattr(self._local, "connection", None) is not None:
+            yield
+            return
+        self._begin()
+        try:
+            yield
+        except BaseException:
+            self._finish(rollback=True)
+            raise
+        else:
+            self._finish(rollback=False)
+
+    def after_commit(self, callback):
+        """Call callback once this thread's transaction commits (never if it rolls back), or now if none is open."""
+        if getattr(self._local, "connection", None) is None:
+            callback()
+        else:
+            self._local.after_commit.append(callback)
+
+    def migrate(self, folder):
+        """
+        Apply the migrations in folder that this database has not seen yet.
+
+        Migrations are SQL files named NNNN_description.sql, applied in order of
+        NNNN, each in its own transaction together with its schema_version row.
+        Migrations are recognised by name, so one can be inserted before others
+        that are renumbered to make room; their rows move to the new numbers.
+        Returns the names of the migrations applied.
+        """
+        self.execute("""
+            CREATE TABLE IF NOT EXISTS "schema_version" (
+                "version" INTEGER,
+                "name" TEXT NOT NULL,
+                "applied" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY("version")
+            )""")
+        found = migrations(folder)
+        numbers = {name: version for version, name, _ in found}
+        with self.transaction():
+            moved = [
+                (numbers[row["name"]], row["name"])
+                for row in self.execute('SELECT "version", "name" FROM "schema_version"')
+                if numbers.get(row["name"], row["version"]) != row["version"]
+            ]
+            # Clear the old numbers first, as they may be each other's new ones
+            for _, name in moved:
+                self.execute('UPDATE "schema_version" SET "version" = -"version" WHERE "name" = ?', name)
+            for version, name in moved:
+                self.execute('UPDATE "schema_version" SET "version" = ? WHERE "name" = ?', version, name)
+        seen = {row["version"] for row in self.execute('SELECT "version" FROM "schema_version"')}
+
+        applied = []
+        for version, name, path in found:
+            if version in seen:
+                continue
+            with open(path) as f:
+                script = self._add_missing_columns(f.read())
+            # The whole script and its version row commit together or not at all
+            try:
+                self.executescript(
+                    f"BEGIN IMMEDIATE;\n{script}\n;"
+                    f"INSERT INTO \"schema_version\" (\"version\", \"name\") VALUES ({version}, '{name}');\n"
+                    "COMMIT;"
+                )
+            except (sqlite3.IntegrityError, sqlite3.OperationalError):
+                # Another process applied this migration first
+                if not self.execute('SELECT 1 FROM "schema_version" WHERE "version" = ?', version):
+                    raise
+                continue
+            applied.append(name)
+        return applied
+
+    def _add_missing_columns(self, script):
+        """Drop the ADD COLUMN IF NOT EXISTS statements of script whose column exists, and the IF NOT EXISTS of the rest."""
+        def rewrite(match):
+            table, column, definition = match.groups()
+            columns = {row["name"] for row in self.execute(f'PRAGMA table_info("{table}")')}
+            return "" if column in columns else f'ALTER TABLE "{table}" ADD COLUMN "{column}"{definition};'
+        return ADD_COLUMN.sub(rewrite, script)
+
+    def query_plan(self, sql, *args):
+        """Return the EXPLAIN QUERY PLAN details of a statement, one string per step."""
+        return [row["detail"] for row in self.execute(f"EXPLAIN QUERY PLAN {sql}", *args)]
+
+    def reset(self):
+        """Roll back and release a transaction this thread left open, e.g. after an error."""
+        if getattr(self._local, "connection", None) is not None:
+            self._finish(rollback=True)
+
+    def _begin(self):
+        if getattr(self._local, "connection", None) is not None:
+            raise RuntimeError("a transaction is already open on this thread")
+        connection = self._acquire()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._release(connection)
+            raise
+        self._local.connection = connection
+        self._local.after_commit = []
+
+    def _finish(self, rollback):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        callbacks, self._local.after_commit = self._local.after_commit, []
+        try:
+            connection.execute("ROLLBACK" if rollback else "COMMIT")
+        finally:
+            self._release(connection)
+        if not rollback:
+            for callback in callbacks:
+                callback()
+
+    @contextmanager
+    def _timed(self, sql, args=()):
+        # Waiting for a pooled connection is not counted, only the statement itself
+        if self.on_query is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.on_query(sql, time.perf_counter() - started, args)
+
+    @contextmanager
+    def _connection(self):
+        """This thread's transaction connection, or one borrowed from the pool."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._release(connection)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+    def _release(self, connection):
+        try:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def _connect(self):
+        # isolation_level=None leaves transactions to BEGIN/COMMIT issued above
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        return connection
+
+
+def migrations(folder):
+    """List (version, name, path) for every migration file in folder, in order."""
+    found = []
+    for filename in os.listdir(folder):
+        if match := re.fullmatch(r"(\d+)_(\w+)\.sql", filename):
+            found.append((int(match.group(1)), match.group(2), os.path.join(folder, filename)))
+    return sorted(found)
+
+
+def full_scans(plan):
+    """
+    Steps of a query plan that read a whole table instead of using an index.
+
+    Scans of subqueries the plan builds itself (CO-ROUTINE/MATERIALIZE), of
+    the single row of INSERT ... SELECT without FROM (CONSTANT ROW) and
+    lookups in full-text indexes (VIRTUAL TABLE) are not counted.
+    """
+    subqueries = {step.split()[1] for step in plan if step.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    return [
+        step for step in plan
+        if step.startswith("SCAN") and "USING" not in step and "VIRTUAL TABLE" not in step
+        and step != "SCAN CONSTANT ROW" and step.split()[1] not in subqueries
+    ]
@@ -2,18 +2,24 @@
 
 
 import ast
+import base64
+import difflib
+import hashlib
+import json
 import re
-import pycountry
-from functools import wraps
+import unicodedata
+from datetime import date
+from functools import cache, lru_cache, wraps
+from types import MappingProxyType
 from wtforms.validators import ValidationError
 from email_validator import EmailNotValidError, validate_email
 from flask_wtf import FlaskForm
-from flask_mail import Message
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import PasswordField, StringField, SubmitField
-from wtforms.validators import DataRequired, Length
+from wtforms.validators import DataRequired, Length, Optional
 from flask import redirect, render_template, session
-from password_strength import PasswordPolicy
+from markupsafe import Markup, escape
+from mailer import message
 
 
 def apology(message, code=400):
@@ -52,16 +58,82 @@ def titlecase(s):
     """
     return re.sub(r"[A-Za-z]+('[A-Za-z]+)?", lambda mo: mo.group(0).capitalize(), s)
 
+# Age of an author on a given day, from a YYYY-MM-DD birthdate
+def age(birth, today):
+    """Return the age in whole years, or an empty string if birth is not a date."""
+    try:
+        born = date.fromisoformat(str(birth)[:10])
+    except ValueError:
+        return ""
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+# Encode and decode the opaque (title, id) cursors used to page through the shelf
+def encode_cursor(title, book_id):
+    raw = json.dumps([title, book_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    """Return (title, id) from a cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        title, book_id = json.loads(raw)
+        return str(title), int(book_id)
+    except (ValueError, TypeError):
+        return None
+
+# Turn marked-up search snippets into safe HTML with the matches highlighted
+def highlight(snippet, start, end):
+    html = str(escape(snippet or ""))
+    return Markup(html.replace(start, "<mark>").replace(end, "</mark>"))
+
+# Hash a file in chunks so large books are never read into memory at once
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Image formats accepted as book covers, by the bytes their files start with
+COVER_SIGNATURES = {b"\xff\xd8\xff": ".jpg", b"\x89PNG\r\n\x1a\n": ".png", b"BM": ".bmp"}
+
+def cover_extension(stream):
+    """The extension for an uploaded cover from its content, or None if it is not a JPEG, PNG or BMP image."""
+    head = stream.read(8)
+    stream.seek(0)
+    return next((extension for signature, extension in COVER_SIGNATURES.items() if head.startswith(signature)), None)
+
+# Page count of an uploaded PDF, or None if it can't be read as one
+def pdf_page_count(path):
+    # PDF files start with %PDF- within their first 1024 bytes
+    with open(path, "rb") as f:
+        if b"%PDF-" not in f.read(1024):
+            return None
+    import fitz
+
+    try:
+        with fitz.open(path, filetype="pdf") as document:
+            return document.page_count or None
+    except RuntimeError:
+        return None
+
 # Check Password
-policy = PasswordPolicy.from_names(
-    length=6,  # minimum length: 8 characters
-    uppercase=1,  # need min. 1 uppercase letters
-    numbers=1,  # need min. 1 digits
-    special=1,  # need min. 1 special characters
-)
+@cache
+def password_policy():
+    """The password policy, built (and password_strength loaded) on first use."""
+    from password_strength import PasswordPolicy
+
+    return PasswordPolicy.from_names(
+        length=6,  # minimum length: 8 characters
+        uppercase=1,  # need min. 1 uppercase letters
+        numbers=1,  # need min. 1 digits
+        special=1,  # need min. 1 special characters
+    )
 
 def check_password_strength(password):
-    return policy.test(password)
+    return password_policy().test(password)
 
 # Create class for form
 class BookForm(FlaskForm):
@@ -69,27 +141,8 @@ class BookForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super(BookForm, self).__init__(*args, **kwargs)
 
-        # Custom list with preferred order
-        self.preferred_countries = [
-        "US",  # United States
-        "CA",  # Canada
-        "GB",  # United Kingdom
-        "NG",  # Nigeria
-        "IN",  # India
-        ]  # Add more as needed
-
-        # Use pycountry to get a list of countries dynamically
-        self.all_countries = list(pycountry.countries)
-
-        # Sort the countries to put preferred ones on top
-        self.all_countries.sort(key=lambda x: (
-            self.preferred_countries.index(x.alpha_2) if x.alpha_2 in self.preferred_countries else float('inf'),
-            x.name
-        ))
-
-        self.country_choices = [(country.name, country.name) for country in self.all_countries]
-
-        # Assign choices to the SelectField
+        # Assign the sorted choices, built once per process, to the field
+        self.country_choices = country_choices()
         self.country.choices = self.country_choices
 
 
@@ -101,7 +154,7 @@ class BookForm(FlaskForm):
     year = StringField("Year", validators=[DataRequired(message="Release Year of Book required")])
     isbn = StringField("ISBN", validators=[DataRequired(message="ISBN Number required")])
     pdf_file = FileField("PDF File", validators=[DataRequired(message="PDF file of Book required"), FileAllowed(["pdf", "epub", "txt", "ibooks", "lit", "azw", "azw3"], "Only images are allowed!")])
-    cover_image = FileField("Book Cover Image", validators=[DataRequired(message="Cover Image of Book required"), FileAllowed(["jpg", "png", "jpeg", "bmp"], "Only images are allowed!")])
+    cover_image = FileField("Book Cover Image", validators=[Optional(), FileAllowed(["jpg", "png", "jpeg", "bmp"], "Only images are allowed!")])
 
 class ForgottenForms(FlaskForm):
     email = StringField("Email")
@@ -124,22 +177,69 @@ def list_to_string(author):
     names_list = [name.strip() for part in author.split(",") for name in part.split(", ")]
     return names_list
 
-def clean_user_input(user_input):
-    # Convert user input to lowercase for case-insensitive comparison
-    user_input_lower = user_input.lower()
+# Countries listed first in country choices, by alpha-2 code
+PREFERRED_COUNTRIES = ("US", "CA", "GB", "NG", "IN")
 
-    # Check if user input matches a country name
-    for country in pycountry.countries:
-        if user_input_lower == country.name.lower():
-            return country.name
+def normalize_country(text):
+    """Casefold text and drop accents and punctuation, so "Côte d'Ivoire" matches "cote divoire"."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", "", text).split())
 
-    # Check if user input matches a country code
-    for country in pycountry.countries:
-        if user_input_lower == country.alpha_2.lower() or user_input_lower == country.alpha_3.lower():
-            return country.name
+@cache
+def country_index():
+    """
+    Map every normalized country name and code to the pycountry name, built on first use.
+
+    Names (including official and common names) take precedence over alpha-2
+    and alpha-3 codes, as they did when countries were searched one by one.
+    pycountry is imported here, as loading it is slow and only adding books
+    needs it.
+    """
+    import pycountry
 
-    # If no match is found, return None or handle as needed
-    return None
+    index = {}
+    for country in pycountry.countries:
+        for name in (country.name, getattr(country, "official_name", None), getattr(country, "common_name", None)):
+            if name:
+                index.setdefault(normalize_country(name), country.name)
+    for country in pycountry.countries:
+        index.setdefault(normalize_country(country.alpha_2), country.name)
+        index.setdefault(normalize_country(country.alpha_3), country.name)
+    return MappingProxyType(index)
+
+@cache
+def country_guesses():
+    """Normalized country names (not codes, which are too short to guess from) by first letter."""
+    names = {}
+    for name in country_index():
+        if len(name) > 3:
+            names.setdefault(name[0], []).append(name)
+    return MappingProxyType({letter: tuple(group) for letter, group in names.items()})
+
+@cache
+def country_choices():
+    """(name, name) choices for every country, preferred countries first and the rest by name."""
+    import pycountry
+
+    rank = {code: position for position, code in enumerate(PREFERRED_COUNTRIES)}
+    countries = sorted(pycountry.countries, key=lambda country: (rank.get(country.alpha_2, len(rank)), country.name))
+    return tuple((country.name, country.name) for country in countries)
+
+@lru_cache(maxsize=1024)
+def clean_user_input(user_input):
+    """Return the pycountry name of a country name or code, allowing for small typos, or None."""
+    key = normalize_country(user_input)
+    index = country_index()
+    if key in index:
+        return index[key]
+
+    # Close misspellings of names, compared only with those that start with the
+    # same letter, so a miss costs a few dozen comparisons instead of every name
+    if not key:
+        return None
+    matches = difflib.get_close_matches(key, country_guesses().get(key[0], ()), n=1, cutoff=0.85)
+    return index[matches[0]] if matches else None
 
 # Helper function to send new users mail
 def graci(email, name):
@@ -161,7 +261,7 @@ def graci(email, name):
         eLibrary Developer
         National Prayer Department
         """
-    return Message(subject, recipients=[email], body=body)
+    return message(subject, [email], body=body)
 
 # Helper functions to send Admin mail
 def gracias(email, User):
@@ -188,7 +288,7 @@ def gracias(email, User):
         eLibrary Developer
         National Prayer Department
         """
-    return Message(subject, recipients=[email], body=body)
+    return message(subject, [email], body=body)
 
 def bienvenido(email, User):
     subject = "Your New Role as Admin in NPD's eLibrary"
@@ -219,4 +319,4 @@ def bienvenido(email, User):
         eLibrary Developer
         National Prayer Department
         """
-    return Message(subject, recipients=[email], body=body)
+    return message(subject, [email], body=body)
@@ -0,0 +1,183 @@
+# Bulk import of books from a manifest file
+
+
+import csv
+import json
+import os
+import secrets
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from books import DuplicateBook, insert_book, parse_authors
+from covers import THUMBNAIL_WIDTHS, make_thumbnails, thumbnail_name
+from helpers import file_digest
+from uploads import store_content_addressed
+
+
+# Columns a manifest row may have; cover is optional
+MANIFEST_FIELDS = ("title", "authors", "countries", "births", "publisher", "year", "isbn", "pdf", "cover")
+
+
+def read_manifest(path):
+    """
+    Read the rows of a CSV or JSON manifest as dicts.
+
+    JSON manifests are a list of objects; their authors, countries and births
+    may be lists instead of comma separated strings.
+    """
+    if path.lower().endswith(".json"):
+        with open(path) as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    for row in rows:
+        for field in ("authors", "countries", "births"):
+            if isinstance(row.get(field), list):
+                row[field] = ", ".join(str(value) for value in row[field])
+        for field in MANIFEST_FIELDS:
+            row[field] = str(row.get(field) or "").strip()
+    return rows
+
+
+def prepare_book(row, pdf_dir, folders):
+    """
+    Copy a book's files into the library and work out what the shelf needs.
+
+    Runs in a worker process. Returns the row extended with pages, sha256,
+    thumb_key, book_path and book_img_path, or with an "error" entry.
+    """
+    import fitz
+
+    upload_folder, img_folder, thumb_folder = folders
+    try:
+        source = os.path.join(pdf_dir, row["pdf"])
+        with fitz.open(source) as document:
+            pages = document.page_count
+        digest = file_digest(source)
+        book_path = _copy_into(source, upload_folder, digest)
+
+        cover_path = None
+        if row["cover"]:
+            cover_source = os.path.join(pdf_dir, row["cover"])
+            cover_path = _copy_into(cover_source, img_folder, file_digest(cover_source))
+
+        thumb_key = make_thumbnails(thumb_folder, cover_path, book_path)
+        book_img_path = cover_path or os.path.join(thumb_folder, thumbnail_name(thumb_key, max(THUMBNAIL_WIDTHS)))
+    except Exception as err:
+        return dict(row, error=str(err))
+    return dict(row, pages=pages, sha256=digest, thumb_key=thumb_key, book_path=book_path, book_img_path=book_img_path)
+
+
+def _copy_into(source, folder, digest):
+    """Copy source into folder under its SHA-256, as uploaded books are stored; returns the stored path."""
+    os.makedirs(folder, exist_ok=True)
+    partial = os.path.join(folder, f".{secrets.token_urlsafe(16)}.part")
+    shutil.copyfile(source, partial)
+    target, _ = store_content_addressed(partial, digest, folder, os.path.splitext(source)[1])
+    return target
+
+
+def import_books(db, manifest, pdf_dir, folders, batch_size=100, workers=None, restart=False, report=print):
+    """
+    Add every book of a manifest to the library.
+
+    PDFs are inspected and thumbnailed in a process pool, books whose ISBN is
+    already on the shelf are skipped, and the rest are committed batch_size at
+    a time. After each batch the position reached is saved to a checkpoint
+    file next to the manifest, so an interrupted import picks up where it
+    stopped; rows that failed are listed in the checkpoint and are retried by
+    starting again with restart. Returns a dict of counts.
+    """
+    rows = read_manifest(manifest)
+    checkpoint_path = manifest + ".checkpoint"
+    checkpoint = {"position": 0, "failed": []}
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    start = checkpoint["position"]
+    counts = {"imported": 0, "skipped": 0, "failed": 0}
+    if start >= len(rows):
+        report(f"All {len(rows)} rows were already imported; use --restart to import again")
+        return counts
+    if start:
+        report(f"Resuming at row {start + 1} of {len(rows)}")
+
+    seen = set()
+    pending = []
+    for position, row in enumerate(rows[start:], start=start):
+        # Rows without an ISBN, or repeating one seen earlier in the manifest, never reach the pool
+        if not row["isbn"] or row["isbn"] in seen:
+            counts["skipped"] += 1
+            continue
+        seen.add(row["isbn"])
+        pending.append((position, row))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(pending), batch_size):
+            chunk = pending[offset:offset + batch_size]
+            isbns = [row["isbn"] for _, row in chunk]
+            existing = {
+                found["isbn"] for found in
+                db.execute(f"SELECT isbn FROM books WHERE isbn IN ({', '.join('?' * len(isbns))})", *isbns)
+            }
+            counts["skipped"] += len(existing)
+            todo = [row for _, row in chunk if row["isbn"] not in existing]
+
+            prepared = list(pool.map(prepare_book, todo, [pdf_dir] * len(todo), [folders] * len(todo)))
+            failed = [row for row in prepared if "error" in row]
+            ready = [row for row in prepared if "error" not in row]
+
+            imported, rejected = _commit_batch(db, ready)
+            failed += rejected
+            counts["imported"] += imported
+            counts["failed"] += len(failed)
+            checkpoint["failed"] += [{"isbn": row["isbn"], "title": row["title"], "error": row["error"]} for row in failed]
+            checkpoint["position"] = chunk[-1][0] + 1
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+            report(f"[{checkpoint['position']}/{len(rows)}] imported {counts['imported']}, "
+                   f"skipped {counts['skipped']}, failed {counts['failed']}")
+            for row in failed:
+                report(f"    {row['isbn']} {row['title']}: {row['error']}")
+
+    checkpoint["position"] = len(rows)
+    _save_checkpoint(checkpoint_path, checkpoint)
+    return counts
+
+
+def _commit_batch(db, rows):
+    """Insert rows in one transaction, or one at a time if the batch fails."""
+    def insert(row):
+        insert_book(
+            db, row["title"], row["isbn"], row["year"], row["publisher"],
+            parse_authors(row["authors"], row["countries"], row["births"]),
+            row["pages"], row["book_path"], row["book_img_path"], row["sha256"], row["thumb_key"],
+        )
+
+    try:
+        with db.transaction():
+            for row in rows:
+                insert(row)
+        return len(rows), []
+    except Exception:
+        pass
+
+    imported, rejected = 0, []
+    for row in rows:
+        try:
+            insert(row)
+            imported += 1
+        except DuplicateBook:
+            rejected.append(dict(row, error="ISBN already on the shelf"))
+        except Exception as err:
+            rejected.append(dict(row, error=str(err)))
+    return imported, rejected
+
+
+def _save_checkpoint(path, checkpoint):
+    # Write then rename, so a crash never leaves half a checkpoint behind
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
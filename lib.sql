@@ -1,3 +1,6 @@
+-- Baseline schema of the library database. Later changes live in migrations/
+-- and are applied on startup or with "flask migrate".
+
 CREATE TABLE "users" (
     "id" INTEGER,
     "name" TEXT NOT NULL,
@@ -0,0 +1,184 @@
+# Outgoing mail queue for the library program
+
+
+import json
+import logging
+import threading
+import time
+
+from metrics import span
+
+
+logger = logging.getLogger(__name__)
+
+# Messages claimed from the outbox per round trip to the database
+BATCH_SIZE = 50
+
+# Seconds a claimed message stays hidden from other workers; the claim is
+# renewed just before each message is sent, so a slow server cannot let it
+# run out in the middle of a batch
+CLAIM_SECONDS = 120
+
+# Seconds between outbox checks when nothing wakes the worker up
+POLL_SECONDS = 30
+
+# Give up on a message after this many failed attempts
+MAX_ATTEMPTS = 8
+
+_app = None
+_mail = None
+_db = None
+_worker = None
+_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def init_outbox(app, db):
+    """
+    Send queued mail for app with Flask-Mail, keeping the outbox in db.
+
+    Flask-Mail, and the smtplib and email packages under it, are loaded the
+    first time a message is built or sent rather than when the app starts.
+    """
+    global _app, _mail, _db
+    _app, _mail, _db = app, None, db
+
+    # Pick up mail left in the outbox by an earlier run once requests start coming in
+    app.before_request(start_sender)
+
+
+def mail():
+    """The Flask-Mail extension of the app, set up on first use."""
+    global _mail
+    with _lock:
+        if _mail is None:
+            from flask_mail import Mail
+
+            _mail = Mail(_app)
+    return _mail
+
+
+def message(subject, recipients, **fields):
+    """Build a Flask-Mail Message, from MAIL_DEFAULT_SENDER unless fields give a sender."""
+    from flask_mail import Message
+
+    mail()
+    return Message(subject, recipients=recipients, **fields)
+
+
+def queue_mail(msg):
+    """Store msg in the outbox and let the worker send it after the request."""
+    sender = msg.sender
+    _db.execute(
+        "INSERT INTO outbox (recipients, subject, body, html, sender) VALUES (?, ?, ?, ?, ?)",
+        json.dumps(msg.recipients), msg.subject, msg.body, msg.html,
+        json.dumps(sender) if sender else None,
+    )
+    start_sender()
+    _wakeup.set()
+
+
+def send_pending():
+    """
+    Send every message that is due, reusing one SMTP connection for all of them.
+
+    Failed messages are retried with exponential backoff until MAX_ATTEMPTS.
+    Returns the number of messages sent.
+    """
+    rows = _claim()
+    if not rows:
+        return 0
+
+    sent = 0
+    try:
+        with mail().connect() as smtp:
+            while rows:
+                row = rows.pop(0)
+                # Skip a message whose claim ran out and that another worker has taken over
+                if _renew(row):
+                    try:
+                        with span("mail_send"):
+                            smtp.send(_message(row))
+                    except Exception as err:
+                        logger.warning("Could not send mail %s: %s", row["id"], err)
+                        _retry(row, err)
+                    else:
+                        _db.execute("UPDATE outbox SET sent = CURRENT_TIMESTAMP, last_error = NULL WHERE id = ?", row["id"])
+                        sent += 1
+                if not rows:
+                    rows = _claim()
+    except Exception as err:
+        # The SMTP server could not be reached; put the rest back for later
+        logger.warning("Could not connect to %s: %s", _app.config["MAIL_SERVER"], err)
+        for row in rows:
+            _retry(row, err)
+    return sent
+
+
+def _claim():
+    """Hide a batch of due messages from other workers and return them."""
+    now = time.time()
+    return _db.execute(
+        """
+        UPDATE outbox SET next_attempt = ?
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE sent IS NULL AND attempts < ? AND next_attempt <= ?
+            ORDER BY next_attempt
+            LIMIT ?
+        )
+        RETURNING id, recipients, subject, body, html, sender, attempts, next_attempt
+        """,
+        now + CLAIM_SECONDS, MAX_ATTEMPTS, now, BATCH_SIZE,
+    )
+
+
+def _renew(row):
+    """Extend the claim on a message about to be sent; False if it is no longer ours."""
+    until = time.time() + CLAIM_SECONDS
+    renewed = _db.execute(
+        "UPDATE outbox SET next_attempt = ? WHERE id = ? AND next_attempt = ? AND sent IS NULL",
+        until, row["id"], row["next_attempt"],
+    )
+    row["next_attempt"] = until
+    return renewed == 1
+
+
+def _retry(row, err):
+    """Put a message back in the outbox after a failure, waiting longer each time."""
+    delay = min(60 * 2 ** row["attempts"], 6 * 60 * 60)
+    _db.execute(
+        "UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?",
+        time.time() + delay, str(err), row["id"],
+    )
+
+
+def _message(row):
+    sender = json.loads(row["sender"]) if row["sender"] else None
+    return message(
+        row["subject"],
+        json.loads(row["recipients"]),
+        body=row["body"],
+        html=row["html"],
+        sender=tuple(sender) if isinstance(sender, list) else sender,
+    )
+
+
+def start_sender():
+    """Send queued mail on a thread of this process, checking the outbox every POLL_SECONDS."""
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="library-mail", daemon=True)
+            _worker.start()
+
+
+def _work():
+    with _app.app_context():
+        while True:
+            _wakeup.clear()
+            try:
+                send_pending()
+            except Exception:
+                logger.exception("Sending queued mail failed")
+            _wakeup.wait(POLL_SECONDS)
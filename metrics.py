@@ -0,0 +1,167 @@
+# Request, query and span metrics for the library program
+
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets, in seconds for durations and in statements for query counts
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    """A Prometheus counter, optionally split by labels."""
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram, optionally split by labels."""
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            # Cumulative bucket counts, then the sum and count of all values
+            values = self._values.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.labels + ("le",)
+        with self._lock:
+            for label_values, values in sorted(self._values.items()):
+                for bound, count in zip(self.buckets + ("+Inf",), values[:-2] + values[-1:]):
+                    lines.append(f"{self.name}_bucket{_labels(bucket_labels, label_values + (bound,))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {values[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {values[-1]}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+REQUEST_SECONDS = Histogram(
+    "library_request_duration_seconds", "Time taken to answer a request.", ("endpoint", "method", "status"))
+REQUEST_QUERIES = Histogram(
+    "library_request_queries", "SQL statements run while answering a request.", ("endpoint",), COUNT_BUCKETS)
+QUERY_SECONDS = Histogram(
+    "library_query_duration_seconds", "Time taken by one SQL statement, by kind of statement.", ("statement",))
+SLOW_QUERIES = Counter(
+    "library_slow_queries_total", "SQL statements slower than the slow query threshold.", ("statement",))
+SPAN_SECONDS = Histogram(
+    "library_span_duration_seconds", "Time spent in mail delivery, PDF parsing and background jobs.", ("span",))
+
+METRICS = (REQUEST_SECONDS, REQUEST_QUERIES, QUERY_SECONDS, SLOW_QUERIES, SPAN_SECONDS)
+
+_slow_query_seconds = 0.1
+_slow_request_seconds = 1.0
+
+
+def init_metrics(app, db, slow_query_ms=100, slow_request_ms=1000):
+    """
+    Time app's requests and db's statements.
+
+    Statements slower than slow_query_ms are logged with their text, and so
+    are the statements of requests slower than slow_request_ms. Every
+    response carries a Server-Timing header with its database time.
+    """
+    global _slow_query_seconds, _slow_request_seconds
+    _slow_query_seconds = slow_query_ms / 1000
+    _slow_request_seconds = slow_request_ms / 1000
+    db.on_query = record_query
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def record_query(sql, seconds, args=()):
+    """Count one statement against its kind and, within a request, against the request."""
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+    QUERY_SECONDS.observe(seconds, statement)
+    if has_request_context() and "queries" in g:
+        g.queries.append((sql, seconds))
+    if seconds >= _slow_query_seconds:
+        SLOW_QUERIES.inc(statement)
+        logger.warning("Slow query (%.1f ms): %s", seconds * 1000, " ".join(sql.split()))
+
+
+@contextmanager
+def span(name):
+    """Time the body of a with-block as the span called name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def render():
+    """All metrics in the Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.queries = []
+
+
+def _finish_request(response):
+    if "request_started" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or "unknown"
+    REQUEST_SECONDS.observe(seconds, endpoint, request.method, response.status_code)
+    REQUEST_QUERIES.observe(len(g.queries), endpoint)
+
+    query_seconds = sum(duration for _, duration in g.queries)
+    response.headers["Server-Timing"] = (
+        f'db;dur={query_seconds * 1000:.1f};desc="{len(g.queries)} queries", app;dur={seconds * 1000:.1f}')
+
+    if seconds >= _slow_request_seconds:
+        slowest = sorted(g.queries, key=lambda query: query[1], reverse=True)[:5]
+        logger.warning(
+            "Slow request %s %s (%.0f ms, %d queries taking %.0f ms); slowest: %s",
+            request.method, request.path, seconds * 1000, len(g.queries), query_seconds * 1000,
+            "; ".join(f"{duration * 1000:.1f} ms {' '.join(sql.split())[:120]}" for sql, duration in slowest),
+        )
+    return response
@@ -0,0 +1,13 @@
+-- Indexes for the lookups made on every request
+
+CREATE INDEX IF NOT EXISTS "authored_author_book" ON "authored" ("author_id", "book_id");
+CREATE INDEX IF NOT EXISTS "authored_book" ON "authored" ("book_id");
+CREATE INDEX IF NOT EXISTS "files_book" ON "files" ("book_id");
+CREATE INDEX IF NOT EXISTS "authors_name_country_birth" ON "authors" ("name", "country", "birth");
+CREATE INDEX IF NOT EXISTS "publishers_publisher" ON "publishers" ("publisher");
+CREATE INDEX IF NOT EXISTS "admins_user" ON "admins" ("user_id");
+
+-- login() matches mail and username with LIKE, which needs NOCASE indexes
+CREATE INDEX IF NOT EXISTS "users_mail" ON "users" ("mail");
+CREATE INDEX IF NOT EXISTS "users_mail_nocase" ON "users" ("mail" COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS "users_username_nocase" ON "users" ("username" COLLATE NOCASE);
@@ -0,0 +1,3 @@
+-- A book may only be on the shelf once; this also indexes lookups by ISBN
+
+CREATE UNIQUE INDEX IF NOT EXISTS "books_isbn" ON "books" ("isbn");
@@ -0,0 +1,20 @@
+-- Publishers and authors become unique so books can be added with UPSERT
+
+-- Merge duplicates left by earlier check-then-insert code into their first row
+UPDATE books SET publisher_id = (
+    SELECT MIN(p2.id) FROM publishers p1 JOIN publishers p2 ON p2.publisher IS p1.publisher
+    WHERE p1.id = books.publisher_id
+) WHERE publisher_id IS NOT NULL;
+DELETE FROM publishers WHERE id NOT IN (SELECT MIN(id) FROM publishers GROUP BY publisher);
+
+UPDATE authored SET author_id = (
+    SELECT MIN(a2.id) FROM authors a1
+    JOIN authors a2 ON a2.name = a1.name AND a2.country IS a1.country AND a2.birth IS a1.birth
+    WHERE a1.id = authored.author_id
+);
+DELETE FROM authors WHERE id NOT IN (SELECT MIN(id) FROM authors GROUP BY name, country, birth);
+
+DROP INDEX IF EXISTS "publishers_publisher";
+DROP INDEX IF EXISTS "authors_name_country_birth";
+CREATE UNIQUE INDEX "publishers_publisher" ON "publishers" ("publisher");
+CREATE UNIQUE INDEX "authors_name_country_birth" ON "authors" ("name", "country", "birth");
@@ -0,0 +1,3 @@
+-- The shelf sorts books by title and the title search matches its prefix
+
+CREATE INDEX IF NOT EXISTS "books_title" ON "books" ("title");
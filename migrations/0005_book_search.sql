@@ -0,0 +1,75 @@
+-- FTS5 index over every book's title, authors, publisher and ISBN. The rowid
+-- of each entry is the id of the book it describes, and the triggers keep it
+-- in step with books, authored, authors and publishers
+
+CREATE VIRTUAL TABLE IF NOT EXISTS "book_search" USING fts5(
+    "title",
+    "authors",
+    "publisher",
+    "isbn",
+    tokenize = "unicode61 remove_diacritics 2",
+    prefix = "2 3"
+);
+
+CREATE TRIGGER IF NOT EXISTS "book_search_books_insert" AFTER INSERT ON "books"
+BEGIN
+    INSERT INTO "book_search" (rowid, "title", "authors", "publisher", "isbn")
+    SELECT NEW.id, NEW.title, '', p.publisher, replace(NEW.isbn, '-', '')
+    FROM (SELECT 1) LEFT JOIN publishers p ON p.id = NEW.publisher_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "book_search_books_update" AFTER UPDATE ON "books"
+BEGIN
+    DELETE FROM "book_search" WHERE rowid = OLD.id;
+    INSERT INTO "book_search" (rowid, "title", "authors", "publisher", "isbn")
+    SELECT b.id, b.title,
+        (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = b.id),
+        p.publisher, replace(b.isbn, '-', '')
+    FROM books b LEFT JOIN publishers p ON p.id = b.publisher_id
+    WHERE b.id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "book_search_books_delete" AFTER DELETE ON "books"
+BEGIN
+    DELETE FROM "book_search" WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "book_search_authored_insert" AFTER INSERT ON "authored"
+BEGIN
+    UPDATE "book_search" SET "authors" =
+        (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = NEW.book_id)
+    WHERE rowid = NEW.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "book_search_authored_delete" AFTER DELETE ON "authored"
+BEGIN
+    UPDATE "book_search" SET "authors" =
+        (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = OLD.book_id)
+    WHERE rowid = OLD.book_id;
+END;
+
+-- An UPSERT that finds an existing row rewrites it unchanged; don't reindex for that
+DROP TRIGGER IF EXISTS "book_search_authors_update";
+CREATE TRIGGER "book_search_authors_update" AFTER UPDATE OF "name" ON "authors"
+WHEN OLD.name IS NOT NEW.name
+BEGIN
+    UPDATE "book_search" SET "authors" =
+        (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = "book_search".rowid)
+    WHERE rowid IN (SELECT book_id FROM authored WHERE author_id = NEW.id);
+END;
+
+DROP TRIGGER IF EXISTS "book_search_publishers_update";
+CREATE TRIGGER "book_search_publishers_update" AFTER UPDATE OF "publisher" ON "publishers"
+WHEN OLD.publisher IS NOT NEW.publisher
+BEGIN
+    UPDATE "book_search" SET "publisher" = NEW.publisher
+    WHERE rowid IN (SELECT id FROM books WHERE publisher_id = NEW.id);
+END;
+
+-- Index the books that were added before the index existed
+INSERT INTO "book_search" (rowid, "title", "authors", "publisher", "isbn")
+SELECT b.id, b.title,
+    (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = b.id),
+    p.publisher, replace(b.isbn, '-', '')
+FROM books b LEFT JOIN publishers p ON p.id = b.publisher_id
+WHERE b.id NOT IN (SELECT rowid FROM "book_search");
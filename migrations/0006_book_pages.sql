@@ -0,0 +1,36 @@
+-- Text of every page of every book, and an FTS5 index over it. book_pages is
+-- the content table; page_search only holds the index and reads snippets back
+-- from book_pages. Deleting a book cascades to its pages and out of the index
+
+CREATE TABLE IF NOT EXISTS "book_pages" (
+    "id" INTEGER,
+    "book_id" INTEGER NOT NULL,
+    "page" INTEGER NOT NULL,
+    "text" TEXT NOT NULL,
+    PRIMARY KEY("id"),
+    FOREIGN KEY("book_id") REFERENCES "books"("id") ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS "book_pages_book" ON "book_pages" ("book_id", "page");
+
+CREATE VIRTUAL TABLE IF NOT EXISTS "page_search" USING fts5(
+    "text",
+    content = "book_pages",
+    content_rowid = "id",
+    tokenize = "unicode61 remove_diacritics 2",
+    prefix = "2 3"
+);
+
+CREATE TRIGGER IF NOT EXISTS "page_search_insert" AFTER INSERT ON "book_pages"
+BEGIN
+    INSERT INTO "page_search" (rowid, "text") VALUES (NEW.id, NEW.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "page_search_delete" AFTER DELETE ON "book_pages"
+BEGIN
+    INSERT INTO "page_search" ("page_search", rowid, "text") VALUES ('delete', OLD.id, OLD.text);
+END;
+
+-- Whether the text of a book file is in book_pages; "flask index-pages"
+-- extracts the books uploaded before this was recorded
+ALTER TABLE "files" ADD COLUMN IF NOT EXISTS "text_indexed" INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,6 @@
+-- The SHA-256 of each book file, sent as its ETag when downloaded, and the key
+-- of the thumbnails made from its cover. Files stored before these were
+-- recorded keep NULL until their first download or "flask make-thumbnails" run
+
+ALTER TABLE "files" ADD COLUMN IF NOT EXISTS "sha256" TEXT;
+ALTER TABLE "files" ADD COLUMN IF NOT EXISTS "thumb_key" TEXT;
@@ -0,0 +1,18 @@
+-- Mail waiting to be sent by the outbox worker, kept until it has gone out
+
+CREATE TABLE IF NOT EXISTS "outbox" (
+    "id" INTEGER,
+    "recipients" TEXT NOT NULL,
+    "subject" TEXT NOT NULL,
+    "body" TEXT,
+    "html" TEXT,
+    "sender" TEXT,
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "next_attempt" REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+    "last_error" TEXT,
+    "sent" NUMERIC,
+    "datetime" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY("id")
+);
+
+CREATE INDEX IF NOT EXISTS "outbox_due" ON "outbox" ("next_attempt") WHERE "sent" IS NULL;
@@ -0,0 +1,119 @@
+-- One denormalized row per book, kept current by triggers, so the shelf is
+-- read without joins or GROUP BY. authors is a JSON array of
+-- {"id", "name", "country", "birth"} objects in the order they were added.
+
+CREATE TABLE "catalog" (
+    "book_id" INTEGER,
+    "isbn" TEXT,
+    "book_title" TEXT NOT NULL,
+    "book_year" NUMERIC,
+    "publisher_name" TEXT,
+    "pages" INTEGER NOT NULL,
+    "date_uploaded" NUMERIC NOT NULL,
+    "book_path" TEXT,
+    "book_img_path" TEXT,
+    "thumb_key" TEXT,
+    "authors" TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY("book_id")
+);
+
+CREATE INDEX "catalog_title" ON "catalog" ("book_title", "book_id");
+
+INSERT INTO "catalog"
+SELECT b.id, b.isbn, b.title, b.year, p.publisher, b.pages, b.date_uploaded,
+    f.book_path, f.book_img_path, f.thumb_key,
+    (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+        SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+        WHERE au.book_id = b.id ORDER BY au.rowid))
+FROM books b
+LEFT JOIN publishers p ON p.id = b.publisher_id
+LEFT JOIN files f ON f.book_id = b.id
+GROUP BY b.id;
+
+CREATE TRIGGER "catalog_books_insert" AFTER INSERT ON "books"
+BEGIN
+    INSERT INTO "catalog" ("book_id", "isbn", "book_title", "book_year", "publisher_name", "pages", "date_uploaded")
+    VALUES (NEW.id, NEW.isbn, NEW.title, NEW.year,
+        (SELECT publisher FROM publishers WHERE id = NEW.publisher_id), NEW.pages, NEW.date_uploaded);
+END;
+
+CREATE TRIGGER "catalog_books_update" AFTER UPDATE ON "books"
+BEGIN
+    UPDATE "catalog" SET
+        "book_id" = NEW.id, "isbn" = NEW.isbn, "book_title" = NEW.title, "book_year" = NEW.year,
+        "publisher_name" = (SELECT publisher FROM publishers WHERE id = NEW.publisher_id),
+        "pages" = NEW.pages, "date_uploaded" = NEW.date_uploaded
+    WHERE "book_id" = OLD.id;
+END;
+
+CREATE TRIGGER "catalog_books_delete" AFTER DELETE ON "books"
+BEGIN
+    DELETE FROM "catalog" WHERE "book_id" = OLD.id;
+END;
+
+CREATE TRIGGER "catalog_files_insert" AFTER INSERT ON "files"
+BEGIN
+    UPDATE "catalog" SET "book_path" = NEW.book_path, "book_img_path" = NEW.book_img_path, "thumb_key" = NEW.thumb_key
+    WHERE "book_id" = NEW.book_id;
+END;
+
+CREATE TRIGGER "catalog_files_update" AFTER UPDATE OF "book_id", "book_path", "book_img_path", "thumb_key" ON "files"
+BEGIN
+    UPDATE "catalog" SET "book_path" = NULL, "book_img_path" = NULL, "thumb_key" = NULL
+    WHERE "book_id" = OLD.book_id AND OLD.book_id IS NOT NEW.book_id;
+    UPDATE "catalog" SET "book_path" = NEW.book_path, "book_img_path" = NEW.book_img_path, "thumb_key" = NEW.thumb_key
+    WHERE "book_id" = NEW.book_id;
+END;
+
+CREATE TRIGGER "catalog_files_delete" AFTER DELETE ON "files"
+BEGIN
+    UPDATE "catalog" SET "book_path" = NULL, "book_img_path" = NULL, "thumb_key" = NULL
+    WHERE "book_id" = OLD.book_id;
+END;
+
+CREATE TRIGGER "catalog_authored_insert" AFTER INSERT ON "authored"
+BEGIN
+    UPDATE "catalog" SET "authors" =
+        (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+            SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+            WHERE au.book_id = NEW.book_id ORDER BY au.rowid))
+    WHERE "book_id" = NEW.book_id;
+END;
+
+CREATE TRIGGER "catalog_authored_update" AFTER UPDATE ON "authored"
+BEGIN
+    UPDATE "catalog" SET "authors" =
+        (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+            SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+            WHERE au.book_id = "catalog".book_id ORDER BY au.rowid))
+    WHERE "book_id" IN (OLD.book_id, NEW.book_id);
+END;
+
+CREATE TRIGGER "catalog_authored_delete" AFTER DELETE ON "authored"
+BEGIN
+    UPDATE "catalog" SET "authors" =
+        (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+            SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+            WHERE au.book_id = OLD.book_id ORDER BY au.rowid))
+    WHERE "book_id" = OLD.book_id;
+END;
+
+-- The UPSERT in insert_book rewrites existing authors unchanged; skip those
+CREATE TRIGGER "catalog_authors_update" AFTER UPDATE OF "name", "country", "birth" ON "authors"
+WHEN OLD.name IS NOT NEW.name OR OLD.country IS NOT NEW.country OR OLD.birth IS NOT NEW.birth
+BEGIN
+    UPDATE "catalog" SET "authors" =
+        (SELECT json_group_array(json_object('id', id, 'name', name, 'country', country, 'birth', birth)) FROM (
+            SELECT a.id, a.name, a.country, a.birth FROM authored au JOIN authors a ON a.id = au.author_id
+            WHERE au.book_id = "catalog".book_id ORDER BY au.rowid))
+    WHERE "book_id" IN (SELECT book_id FROM authored WHERE author_id = NEW.id);
+END;
+
+CREATE TRIGGER "catalog_publishers_update" AFTER UPDATE OF "publisher" ON "publishers"
+WHEN OLD.publisher IS NOT NEW.publisher
+BEGIN
+    UPDATE "catalog" SET "publisher_name" = NEW.publisher
+    WHERE "book_id" IN (SELECT id FROM books WHERE publisher_id = NEW.id);
+END;
+
+DROP VIEW IF EXISTS "longlist";
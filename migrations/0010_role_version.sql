@@ -0,0 +1,25 @@
+-- A counter bumped whenever the admins table changes, so processes caching
+-- the set of admins know when to read it again
+
+CREATE TABLE "role_version" (
+    "id" INTEGER CHECK ("id" = 1),
+    "version" INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("id")
+);
+
+INSERT INTO "role_version" ("id", "version") VALUES (1, 0);
+
+CREATE TRIGGER "role_version_admins_insert" AFTER INSERT ON "admins"
+BEGIN
+    UPDATE "role_version" SET "version" = "version" + 1 WHERE "id" = 1;
+END;
+
+CREATE TRIGGER "role_version_admins_update" AFTER UPDATE ON "admins"
+BEGIN
+    UPDATE "role_version" SET "version" = "version" + 1 WHERE "id" = 1;
+END;
+
+CREATE TRIGGER "role_version_admins_delete" AFTER DELETE ON "admins"
+BEGIN
+    UPDATE "role_version" SET "version" = "version" + 1 WHERE "id" = 1;
+END;
@@ -0,0 +1,10 @@
+-- Server-side session data, swept by expiry
+
+CREATE TABLE "sessions" (
+    "id" TEXT,
+    "data" TEXT NOT NULL,
+    "expires" REAL NOT NULL,
+    PRIMARY KEY("id")
+) WITHOUT ROWID;
+
+CREATE INDEX "sessions_expires" ON "sessions" ("expires");
@@ -0,0 +1,19 @@
+-- Resumable uploads in progress; their bytes are in partial files on disk
+
+CREATE TABLE "uploads" (
+    "id" TEXT,
+    "user_id" INTEGER NOT NULL,
+    "filename" TEXT,
+    "length" INTEGER NOT NULL,
+    "received" INTEGER NOT NULL DEFAULT 0,
+    "created" REAL NOT NULL,
+    "updated" REAL NOT NULL,
+    PRIMARY KEY("id"),
+    FOREIGN KEY("user_id") REFERENCES "users"("id") ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX "uploads_updated" ON "uploads" ("updated");
+
+-- Stored files are shared by identical books; deleting one checks for others
+CREATE INDEX "files_book_path" ON "files" ("book_path");
+CREATE INDEX "files_book_img_path" ON "files" ("book_img_path");
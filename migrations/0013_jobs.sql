@@ -0,0 +1,15 @@
+-- Durable queue of background jobs. A job is deleted once it succeeds; one
+-- that keeps failing stays behind with its last error for inspection
+
+CREATE TABLE "jobs" (
+    "id" INTEGER,
+    "name" TEXT NOT NULL,
+    "args" TEXT NOT NULL DEFAULT '[]',
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "next_attempt" REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+    "last_error" TEXT,
+    "created" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY("id")
+);
+
+CREATE INDEX "jobs_due" ON "jobs" ("next_attempt", "attempts");
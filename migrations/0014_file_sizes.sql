@@ -0,0 +1,5 @@
+-- Sizes of each book file as uploaded and as stored after optimization; both
+-- stay NULL until the file has been through the optimize_book job
+
+ALTER TABLE "files" ADD COLUMN "original_size" INTEGER;
+ALTER TABLE "files" ADD COLUMN "stored_size" INTEGER;
@@ -0,0 +1,25 @@
+-- Downloads and views of each book, per day (UTC) and in total, written in
+-- batches from the read event buffer of each web process
+
+CREATE TABLE "book_stats" (
+    "book_id" INTEGER NOT NULL,
+    "day" TEXT NOT NULL,
+    "downloads" INTEGER NOT NULL DEFAULT 0,
+    "views" INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("book_id", "day"),
+    FOREIGN KEY("book_id") REFERENCES "books"("id") ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Sums over recent days read only this index
+CREATE INDEX "book_stats_day" ON "book_stats" ("day", "book_id", "downloads", "views");
+
+CREATE TABLE "book_popularity" (
+    "book_id" INTEGER,
+    "downloads" INTEGER NOT NULL DEFAULT 0,
+    "views" INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("book_id"),
+    FOREIGN KEY("book_id") REFERENCES "books"("id") ON DELETE CASCADE
+);
+
+-- Most read first, in the order the popular shelf asks for
+CREATE INDEX "book_popularity_reads" ON "book_popularity" ("downloads" + "views" DESC, "book_id");
@@ -0,0 +1,52 @@
+-- Book recommendations, one row per requested title however it was typed, with
+-- one vote per user who asked for it. Rows left in the old recommendations
+-- table are moved in by RecommendationQueue.import_legacy() at startup, as
+-- titles are matched on a key SQL can't compute (casefolded, accents dropped)
+
+CREATE TABLE "book_requests" (
+    "id" INTEGER,
+    "key" TEXT NOT NULL,
+    "title" TEXT NOT NULL,
+    "votes" INTEGER NOT NULL DEFAULT 0,
+    "first_requested" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "last_requested" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "resolved" NUMERIC,
+    "book_id" INTEGER,
+    PRIMARY KEY("id"),
+    FOREIGN KEY("book_id") REFERENCES "books"("id") ON DELETE SET NULL
+);
+
+CREATE UNIQUE INDEX "book_requests_key" ON "book_requests" ("key");
+
+-- The admin page lists open and resolved requests by votes, recency or title
+CREATE INDEX "book_requests_votes" ON "book_requests" ("resolved" IS NULL, "votes" DESC, "id");
+CREATE INDEX "book_requests_recent" ON "book_requests" ("resolved" IS NULL, "last_requested" DESC, "id");
+CREATE INDEX "book_requests_title" ON "book_requests" ("resolved" IS NULL, "key", "id");
+
+CREATE TABLE "book_request_votes" (
+    "request_id" INTEGER NOT NULL,
+    "user_id" INTEGER NOT NULL,
+    "datetime" NUMERIC NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY("request_id", "user_id"),
+    FOREIGN KEY("request_id") REFERENCES "book_requests"("id") ON DELETE CASCADE,
+    FOREIGN KEY("user_id") REFERENCES "users"("id") ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX "book_request_votes_user" ON "book_request_votes" ("user_id");
+
+-- Keep the vote count and the time of the latest request in step with the votes
+CREATE TRIGGER "book_request_votes_insert" AFTER INSERT ON "book_request_votes"
+BEGIN
+    UPDATE "book_requests" SET
+        "votes" = "votes" + 1,
+        "last_requested" = MAX("last_requested", NEW."datetime")
+    WHERE "id" = NEW."request_id";
+END;
+
+CREATE TRIGGER "book_request_votes_delete" AFTER DELETE ON "book_request_votes"
+BEGIN
+    UPDATE "book_requests" SET "votes" = "votes" - 1 WHERE "id" = OLD."request_id";
+END;
+
+-- The admin page no longer reads the unpaged users x recommendations join
+DROP VIEW IF EXISTS "suggestions";
@@ -0,0 +1,5 @@
+-- The request appending to each upload. It is claimed together with the
+-- offset in one UPDATE, so only one process writes to an upload at a time; a
+-- claim lapses once its writer has not reported progress for a while
+
+ALTER TABLE "uploads" ADD COLUMN IF NOT EXISTS "writer" TEXT;
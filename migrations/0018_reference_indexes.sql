@@ -0,0 +1,11 @@
+-- Indexes for columns looked up by triggers and foreign keys rather than by
+-- the app's own queries, found by tests/test_query_plans.py
+
+-- Renaming a publisher reindexes its books (book_search_publishers_update)
+CREATE INDEX IF NOT EXISTS "books_publisher" ON "books" ("publisher_id");
+
+-- Adding or deleting a book checks the requests that point at it
+CREATE INDEX IF NOT EXISTS "book_requests_book" ON "book_requests" ("book_id");
+
+-- Thumbnails are removed once no file uses their key any more
+CREATE INDEX IF NOT EXISTS "files_thumb_key" ON "files" ("thumb_key");
@@ -0,0 +1,10 @@
+-- files.sha256 stays the digest of a book file as uploaded, which names the
+-- stored file; stored_sha256 is the digest of its bytes once the
+-- optimize_book job has rewritten it, and is sent as its ETag. optimizing is
+-- when a job claimed the file, so only one job rewrites a shared file
+
+ALTER TABLE "files" ADD COLUMN IF NOT EXISTS "stored_sha256" TEXT;
+ALTER TABLE "files" ADD COLUMN IF NOT EXISTS "optimizing" REAL;
+
+-- Files optimized before had their sha256 replaced by the digest of the new bytes
+UPDATE "files" SET "stored_sha256" = "sha256" WHERE "stored_size" IS NOT NULL AND "stored_sha256" IS NULL;
@@ -0,0 +1,84 @@
+# Shrinking stored book files for the library program
+
+
+import os
+import secrets
+
+from metrics import span
+
+
+# JPEG quality of images resampled by downsample_images
+JPEG_QUALITY = 80
+
+
+def optimize_pdf(path, max_image_dpi=0):
+    """
+    Rewrite the PDF at path smaller and linearized, if that makes it smaller.
+
+    Unused objects are dropped, duplicates merged and every stream deflated,
+    and the file is linearized ("fast web view") so viewers can show page 1
+    before the rest has arrived. With max_image_dpi, images shown at a higher
+    resolution are first resampled down to it. The file is only replaced
+    when the rewrite is smaller; files that are not PDFs, or are encrypted,
+    are left alone. Returns (original_size, stored_size).
+    """
+    import fitz
+
+    original_size = os.path.getsize(path)
+    partial = f"{path}.{secrets.token_hex(4)}.optimizing"
+    try:
+        with span("pdf_optimize"), fitz.open(path) as document:
+            if not document.is_pdf or document.is_encrypted:
+                return original_size, original_size
+            if max_image_dpi:
+                downsample_images(document, max_image_dpi)
+            document.save(partial, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, linear=True)
+
+        optimized_size = os.path.getsize(partial)
+        if optimized_size >= original_size:
+            return original_size, original_size
+        os.replace(partial, path)
+        return original_size, optimized_size
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def downsample_images(document, max_dpi):
+    """
+    Resample images shown above max_dpi down to it, as JPEG.
+
+    The resolution of an image is taken from the largest place it is drawn on
+    the first page that uses it. Images with a transparency mask are kept as
+    they are. Returns the number of images replaced.
+    """
+    import fitz
+
+    seen, replaced = set(), 0
+    for page in document:
+        for image in page.get_images(full=True):
+            xref, smask = image[0], image[1]
+            if xref in seen or smask:
+                continue
+            seen.add(xref)
+            rects = page.get_image_rects(xref)
+            if not rects:
+                continue
+
+            # Compare the longer sides, so rotated images measure the same
+            inches = max(max(rect.width, rect.height) for rect in rects) / 72
+            pixmap = fitz.Pixmap(document, xref)
+            dpi = max(pixmap.width, pixmap.height) / inches
+            if dpi <= max_dpi:
+                continue
+
+            # JPEG holds neither transparency nor unusual colorspaces
+            if pixmap.alpha:
+                pixmap = fitz.Pixmap(pixmap, 0)
+            if not pixmap.colorspace or pixmap.colorspace.n not in (1, 3):
+                pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+            scale = max_dpi / dpi
+            smaller = fitz.Pixmap(pixmap, max(1, round(pixmap.width * scale)), max(1, round(pixmap.height * scale)), None)
+            page.replace_image(xref, stream=smaller.tobytes("jpg", jpg_quality=JPEG_QUALITY))
+            replaced += 1
+    return replaced
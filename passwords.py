@@ -0,0 +1,64 @@
+# Password hashing for the library program
+
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(RuntimeError):
+    """Too many passwords are already waiting to be hashed."""
+
+
+class PasswordHasher:
+    """
+    Hash and check passwords in a small pool of worker processes.
+
+    The key derivation runs outside the web workers, at most `workers` at a
+    time with up to `backlog` more waiting; beyond that, or after waiting
+    `timeout` seconds for a place, HasherBusy is raised instead of letting
+    requests pile up. method is a werkzeug method string such as
+    "scrypt:32768:8:1" or "pbkdf2:sha256:600000"; hashes made with any other
+    method still verify, and needs_rehash() tells when to replace them.
+    """
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, backlog=8, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with other parameters than the configured method."""
+        return pwhash.split("$", 1)[0] != self.method
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy("too many passwords waiting to be hashed")
+        try:
+            try:
+                return self._executor().submit(func, *args).result()
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool and try once more
+                with self._lock:
+                    self._pool = None
+                return self._executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _executor(self):
+        with self._lock:
+            # Started on first use, so each server process gets its own pool
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
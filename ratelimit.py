@@ -0,0 +1,40 @@
+# Rate limiting for the library program
+
+
+import threading
+import time
+
+
+class TokenBucketLimiter:
+    """
+    Allow each key a burst of attempts, refilled at a steady rate.
+
+    Every key (a username, an IP address) has a bucket of up to `burst`
+    tokens that refills at `per_minute` tokens a minute; an attempt takes one
+    token and is refused when the bucket is empty. Buckets that have filled
+    up again are forgotten once more than max_keys are tracked.
+    """
+
+    def __init__(self, per_minute, burst, max_keys=10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take a token for key; return False if it has none left."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return allowed
+
+    def _prune(self, now):
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self._buckets[key]
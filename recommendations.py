@@ -0,0 +1,98 @@
+# Book recommendations from readers for the library program
+
+
+from helpers import titlecase
+from suggest import fold
+
+
+# Orders the admin page can list requests in
+SORTS = {
+    "votes": 'r."votes" DESC, r."id"',
+    "recent": 'r."last_requested" DESC, r."id"',
+    "title": 'r."key", r."id"',
+}
+
+
+class RecommendationQueue:
+    """
+    Books readers asked for, one entry per title with a vote per reader.
+
+    Requests are matched on their folded title, so "things  fall APART" adds
+    a vote to "Things Fall Apart" instead of a new row. An entry is resolved
+    by an admin, or automatically when a book with its title is added; asking
+    again for a resolved title opens it again.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, user_id, text, when=None):
+        """Record user_id's vote for the book text names; returns the request id, or None if text is blank."""
+        key = fold(text)
+        if not key:
+            return None
+        title = titlecase(" ".join(text.split()))
+        with self.db.transaction():
+            request_id = self.db.execute(
+                'INSERT INTO "book_requests" ("key", "title", "first_requested", "last_requested") '
+                "VALUES (?1, ?2, COALESCE(?3, CURRENT_TIMESTAMP), COALESCE(?3, CURRENT_TIMESTAMP)) "
+                'ON CONFLICT ("key") DO UPDATE SET "resolved" = NULL, "book_id" = NULL, '
+                '"first_requested" = MIN("first_requested", excluded."first_requested") RETURNING "id"',
+                key, title, when,
+            )[0]["id"]
+            # A reader's repeated requests count once
+            self.db.execute(
+                'INSERT INTO "book_request_votes" ("request_id", "user_id", "datetime") '
+                "VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP)) ON CONFLICT DO NOTHING",
+                request_id, user_id, when,
+            )
+        return request_id
+
+    def page(self, resolved=False, sort="votes", page=1, size=50):
+        """Return (rows, total) for one page of open (or resolved) requests in the given order."""
+        rows = self.db.execute(
+            f'SELECT r.*, b."title" AS "book_title" FROM "book_requests" r '
+            f'LEFT JOIN "books" b ON b."id" = r."book_id" '
+            f'WHERE (r."resolved" IS NULL) = ? ORDER BY {SORTS.get(sort, SORTS["votes"])} '
+            f"LIMIT ? OFFSET ?",
+            not resolved, size, (max(page, 1) - 1) * size,
+        )
+        total = self.db.execute(
+            'SELECT COUNT(*) AS count FROM "book_requests" WHERE ("resolved" IS NULL) = ?', not resolved)[0]["count"]
+        return rows, total
+
+    def resolve(self, ids, book_id=None):
+        """Mark requests as dealt with; returns how many were still open."""
+        if not ids:
+            return 0
+        return self.db.execute(
+            f'UPDATE "book_requests" SET "resolved" = CURRENT_TIMESTAMP, "book_id" = ? '
+            f'WHERE "id" IN ({", ".join("?" * len(ids))}) AND "resolved" IS NULL',
+            book_id, *ids,
+        )
+
+    def delete(self, ids):
+        """Drop requests and their votes; returns how many were deleted."""
+        if not ids:
+            return 0
+        return self.db.execute(f'DELETE FROM "book_requests" WHERE "id" IN ({", ".join("?" * len(ids))})', *ids)
+
+    def resolve_title(self, title, book_id):
+        """Resolve the open request for title, now that book_id has it; returns whether there was one."""
+        return bool(self.db.execute(
+            'UPDATE "book_requests" SET "resolved" = CURRENT_TIMESTAMP, "book_id" = ? '
+            'WHERE "key" = ? AND "resolved" IS NULL',
+            book_id, fold(title),
+        ))
+
+    def import_legacy(self):
+        """Move rows left in the old free-text recommendations table into the queue; returns how many."""
+        rows = self.db.execute('SELECT "user_id", "recommendation", "datetime" FROM "recommendations"')
+        if not rows:
+            return 0
+        with self.db.transaction():
+            for row in rows:
+                if row["user_id"] is not None:
+                    self.add(row["user_id"], row["recommendation"], row["datetime"])
+            self.db.execute('DELETE FROM "recommendations"')
+        return len(rows)
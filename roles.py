@@ -0,0 +1,46 @@
+# Admin roles for the library program
+
+
+import threading
+
+
+class AdminRoles:
+    """
+    The ids of admin users, cached in memory.
+
+    Triggers bump the role_version row whenever the admins table changes, so
+    a process reads the table again only after a grant or revoke, wherever
+    it happened.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = frozenset()
+
+    def version(self):
+        """The current role version; it changes with every grant or revoke."""
+        return self.db.execute('SELECT "version" FROM "role_version" WHERE "id" = 1')[0]["version"]
+
+    def ids(self):
+        """Return the set of admin user ids, reloading it only when roles changed."""
+        version = self.version()
+        with self._lock:
+            if version != self._version:
+                self._ids = frozenset(row["user_id"] for row in self.db.execute("SELECT user_id FROM admins"))
+                self._version = version
+            return self._ids
+
+    def is_admin(self, user_id):
+        return user_id in self.ids()
+
+    def grant(self, user_id):
+        """Make a user an admin; granting twice does nothing."""
+        self.db.execute(
+            "INSERT INTO admins (user_id) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM admins WHERE user_id = ?)",
+            user_id, user_id,
+        )
+
+    def revoke(self, user_id):
+        self.db.execute("DELETE FROM admins WHERE user_id = ?", user_id)
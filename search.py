@@ -0,0 +1,84 @@
+# Full-text search helpers for the library program
+
+
+import re
+
+from metrics import span
+
+
+# Refill the emptied book_search index from the catalog tables. The index,
+# the page index and their triggers are created by migrations 0005 and 0006
+REBUILD = """
+INSERT INTO "book_search" (rowid, "title", "authors", "publisher", "isbn")
+SELECT b.id, b.title,
+    (SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '') FROM authored au JOIN authors a ON a.id = au.author_id WHERE au.book_id = b.id),
+    p.publisher, replace(b.isbn, '-', '')
+FROM books b LEFT JOIN publishers p ON p.id = b.publisher_id;
+"""
+
+# bm25 column weights: title, authors, publisher, isbn
+WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+# Pages written to the database per transaction while extracting a book
+PAGE_BATCH = 50
+
+# Markers placed around matched words in page snippets
+MARK_START, MARK_END = "\x02", "\x03"
+
+
+def rebuild_search_index(db):
+    """Empty the book search index and refill it from the catalog tables."""
+    with db.transaction():
+        db.execute('DELETE FROM "book_search"')
+        db.execute(REBUILD)
+    return db.execute('SELECT COUNT(*) AS count FROM "book_search"')[0]["count"]
+
+
+def match_query(text):
+    """
+    Turn free text from the search box into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term so partial words still match and
+    FTS5 operators typed by users are treated as plain text. ISBNs are searched
+    without their hyphens, the same way they are indexed. Returns None when
+    there is nothing to search for.
+    """
+    words = []
+    for word in text.split():
+        if re.fullmatch(r"[\d-]+[xX]?", word):
+            word = word.replace("-", "")
+        words.extend(re.findall(r"\w+", word))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def index_book_pages(db, book_id, pdf_path):
+    """
+    Extract the text of a book page by page into book_pages.
+
+    Pages are read one at a time and written in batches of PAGE_BATCH, so even
+    very long books never sit in memory whole. Runs on the task worker, not in
+    a request. Returns the number of pages with text.
+    """
+    import fitz
+
+    insert = 'INSERT INTO "book_pages" ("book_id", "page", "text") VALUES (?, ?, ?)'
+    with span("pdf_text"), fitz.open(pdf_path) as document:
+        db.execute('DELETE FROM "book_pages" WHERE "book_id" = ?', book_id)
+
+        batch, count = [], 0
+        for page in document:
+            text = page.get_text().strip()
+            if text:
+                batch.append((book_id, page.number + 1, text))
+            if len(batch) >= PAGE_BATCH:
+                with db.transaction():
+                    db.executemany(insert, batch)
+                count += len(batch)
+                batch = []
+
+        with db.transaction():
+            db.executemany(insert, batch)
+            db.execute('UPDATE "files" SET "text_indexed" = 1 WHERE "book_id" = ?', book_id)
+        return count + len(batch)
@@ -0,0 +1,173 @@
+# Server-side sessions for the library program
+
+
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data loaded from a store, remembering whether it changed."""
+
+    def __init__(self, data=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(data, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new random id and drop the stored one.
+
+        Call it when the user logs in or out, so an id someone else planted
+        or saw before is never the one that is signed in.
+        """
+        self.replaced_sid = self.replaced_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SessionStore:
+    """Where session data lives; subclasses implement load, save and delete."""
+
+    def load(self, sid):
+        """Return the data saved for sid, or None if there is none or it expired."""
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        """Store data (bytes) for sid until the timestamp expires."""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Remove expired sessions, for stores that do not expire them by themselves."""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in the sessions table of the library database.
+
+    Expired rows are removed by a sweep over the expiry index, run at most
+    once every sweep_seconds while sessions are being saved.
+    """
+
+    def __init__(self, db, sweep_seconds=600):
+        self.db = db
+        self.sweep_seconds = sweep_seconds
+        self._next_sweep = 0
+
+    def load(self, sid):
+        rows = self.db.execute('SELECT "data" FROM "sessions" WHERE "id" = ? AND "expires" > ?', sid, time.time())
+        return rows[0]["data"] if rows else None
+
+    def save(self, sid, data, expires):
+        self.db.execute(
+            'INSERT INTO "sessions" ("id", "data", "expires") VALUES (?, ?, ?) '
+            'ON CONFLICT ("id") DO UPDATE SET "data" = excluded.data, "expires" = excluded.expires',
+            sid, data, expires,
+        )
+        if time.time() >= self._next_sweep:
+            self._next_sweep = time.time() + self.sweep_seconds
+            self.sweep()
+
+    def delete(self, sid):
+        self.db.execute('DELETE FROM "sessions" WHERE "id" = ?', sid)
+
+    def sweep(self):
+        return self.db.execute('DELETE FROM "sessions" WHERE "expires" <= ?', time.time())
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis, or anything speaking its protocol, which expires them itself.
+
+    Pass client to use an existing connection, e.g. fakeredis.FakeRedis() as a
+    local stand-in; otherwise one is made from url with the redis package.
+    """
+
+    def __init__(self, url=None, client=None, prefix="library:session:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("SESSION_BACKEND=redis needs the redis package (pip install redis)") from None
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        return self.client.get(self.prefix + sid)
+
+    def save(self, sid, data, expires):
+        self.client.set(self.prefix + sid, data, ex=max(1, int(expires - time.time())))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keep session data in a SessionStore and only a random session id in the cookie.
+
+    Sessions are written back only when they change or when more than half of
+    their lifetime has passed, so most requests cost a single read.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                try:
+                    expires, values = self.serializer.loads(data)
+                    return ServerSession(values, sid=sid, expires=expires)
+                except ValueError:
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        stale = session.expires is None or session.expires - now < lifetime / 2
+        if not (session.modified or stale):
+            return
+
+        expires = now + lifetime
+        self.store.save(session.sid, self.serializer.dumps([expires, dict(session)]), expires)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
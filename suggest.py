@@ -0,0 +1,122 @@
+# Search-as-you-type suggestions for the library program
+
+
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+
+def fold(text):
+    """Casefold text and drop accents, so "Émile" and "emile" share a key."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+class SuggestionIndex:
+    """
+    Book titles and author names, completed from any prefix without SQL.
+
+    Every title and name is kept in a sorted list under its folded text, and
+    again under each later word ("apart" finds "Things Fall Apart"), so a
+    prefix is a bisect and a short forward scan. Completions that start with
+    the prefix rank before ones that only have a word starting with it.
+    Books are added and removed as the shelf changes; the whole index is
+    rebuilt from db at most every refresh_seconds, which picks up changes
+    made by other processes.
+    """
+
+    def __init__(self, db, refresh_seconds=300):
+        self.db = db
+        self.refresh_seconds = refresh_seconds
+        self._starts = []
+        self._words = []
+        self._books = {}
+        self._entries = {}
+        self._built = None
+        self._lock = threading.Lock()
+
+    def suggest(self, prefix, limit=8):
+        """Return up to limit (text, kind) completions of prefix, kind being "title" or "author"."""
+        key = fold(prefix)
+        if not key:
+            return []
+        if self._built is None:
+            self.rebuild()
+        elif time.monotonic() - self._built > self.refresh_seconds:
+            with self._lock:
+                # One request reloads while the others answer from the current index
+                stale, self._built = time.monotonic() - self._built > self.refresh_seconds, time.monotonic()
+            if stale:
+                self.rebuild()
+
+        found = {}
+        with self._lock:
+            for entries in (self._starts, self._words):
+                i = bisect_left(entries, (key,))
+                while i < len(entries) and len(found) < limit and entries[i][0].startswith(key):
+                    _, kind, text = entries[i]
+                    found.setdefault((text, kind), None)
+                    i += 1
+        return list(found)
+
+    def add_book(self, book_id, title, authors):
+        """Index a new book's title and author names."""
+        entries = [("title", title)] + [("author", name) for name in authors]
+        with self._lock:
+            self._add(book_id, entries)
+
+    def remove_book(self, book_id):
+        """Drop a deleted book, and each title or name no other book still has."""
+        with self._lock:
+            for entry in self._books.pop(book_id, ()):
+                books = self._entries[entry]
+                books.discard(book_id)
+                if not books:
+                    del self._entries[entry]
+                    keys = self._keys(entry)
+                    for target, keyed in [(self._starts, keys[0])] + [(self._words, key) for key in keys[1:]]:
+                        i = bisect_left(target, keyed)
+                        if i < len(target) and target[i] == keyed:
+                            del target[i]
+
+    def rebuild(self):
+        """Reload every title and author name from the database."""
+        rows = self.db.execute("""
+            SELECT b.id AS book_id, 'title' AS kind, b.title AS text FROM books b
+            UNION ALL
+            SELECT au.book_id, 'author', a.name FROM authored au JOIN authors a ON a.id = au.author_id
+        """)
+        index = SuggestionIndex(self.db)
+        for row in rows:
+            index._add(row["book_id"], [(row["kind"], row["text"])], sort=False)
+        index._starts.sort()
+        index._words.sort()
+        with self._lock:
+            self._starts, self._words = index._starts, index._words
+            self._books, self._entries = index._books, index._entries
+            self._built = time.monotonic()
+
+    def _add(self, book_id, entries, sort=True):
+        for entry in entries:
+            if not entry[1] or book_id in self._entries.get(entry, ()):
+                # Skip blanks, and a name the book lists twice so removing it drops it once
+                continue
+            self._books.setdefault(book_id, []).append(entry)
+            if entry in self._entries:
+                self._entries[entry].add(book_id)
+                continue
+            self._entries[entry] = {book_id}
+            keys = self._keys(entry)
+            for target, keyed in [(self._starts, keys[0])] + [(self._words, key) for key in keys[1:]]:
+                if sort:
+                    insort(target, keyed)
+                else:
+                    target.append(keyed)
+
+    @staticmethod
+    def _keys(entry):
+        """(key, kind, text) for the whole text, then for the rest of it from each later word."""
+        kind, text = entry
+        words = fold(text).split(" ")
+        return [(" ".join(words[i:]), kind, text) for i in range(len(words))]
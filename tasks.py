@@ -0,0 +1,190 @@
+# Durable background jobs for the library program
+
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import span
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed job stays hidden from other workers while it runs; a
+# worker that dies mid-job gives it back when this runs out
+VISIBILITY_SECONDS = 600
+
+# Seconds between renewals of the claim on a running job, so a job that runs
+# longer than VISIBILITY_SECONDS is not claimed and run a second time
+HEARTBEAT_SECONDS = VISIBILITY_SECONDS / 4
+
+# Seconds between queue checks when nothing wakes a worker up
+POLL_SECONDS = 30
+
+# Give up on a job after this many attempts
+MAX_ATTEMPTS = 5
+
+_db = None
+_app = None
+_handlers = {}
+_workers = []
+_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def init_tasks(app, db, threads=1):
+    """
+    Keep jobs for app in db and run them on threads worker threads.
+
+    With threads=0 nothing runs in the web process and jobs wait for
+    "flask worker" instead.
+    """
+    global _app, _db
+    _app, _db = app, db
+    if threads:
+        # Pick up jobs left by an earlier run once requests start coming in
+        app.before_request(lambda: _start_workers(threads))
+
+
+def task(name):
+    """Register the decorated function as the handler of jobs called name."""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, *args, delay=0):
+    """Queue a job running the handler of name with args (JSON values); returns its id."""
+    job_id = _db.execute(
+        "INSERT INTO jobs (name, args, next_attempt) VALUES (?, ?, ?)",
+        name, json.dumps(args), time.time() + delay,
+    )
+    # A worker woken before the job is committed would not see it yet
+    _db.after_commit(_wakeup.set)
+    return job_id
+
+
+def run_pending(limit=None):
+    """Run due jobs on this thread until none are left (or limit ran); returns how many ran."""
+    count = 0
+    while limit is None or count < limit:
+        job = _claim()
+        if job is None:
+            break
+        _run(job)
+        count += 1
+    return count
+
+
+def depth():
+    """Count jobs per name: due now, scheduled for later (or running), and failed for good."""
+    return _db.execute(
+        """
+        SELECT name,
+            SUM(attempts < ? AND next_attempt <= ?) AS due,
+            SUM(attempts < ? AND next_attempt > ?) AS scheduled,
+            SUM(attempts >= ?) AS failed
+        FROM jobs GROUP BY name ORDER BY name
+        """,
+        MAX_ATTEMPTS, time.time(), MAX_ATTEMPTS, time.time(), MAX_ATTEMPTS,
+    )
+
+
+def retry_failed():
+    """Give jobs that ran out of attempts another round; returns how many."""
+    return _db.execute(
+        "UPDATE jobs SET attempts = 0, next_attempt = ? WHERE attempts >= ?", time.time(), MAX_ATTEMPTS)
+
+
+def work(threads=1):
+    """Run jobs on threads threads until interrupted, e.g. from "flask worker"."""
+    _start_workers(threads)
+    try:
+        while True:
+            time.sleep(POLL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+
+
+def _claim():
+    """Hide the next due job from other workers and return it, or None."""
+    now = time.time()
+    rows = _db.execute(
+        """
+        UPDATE jobs SET attempts = attempts + 1, next_attempt = ?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE attempts < ? AND next_attempt <= ?
+            ORDER BY next_attempt
+            LIMIT 1
+        )
+        RETURNING id, name, args, attempts, next_attempt
+        """,
+        now + VISIBILITY_SECONDS, MAX_ATTEMPTS, now,
+    )
+    return rows[0] if rows else None
+
+
+def _run(job):
+    try:
+        with span(f"job_{job['name']}"), _heartbeat(job):
+            _handlers[job["name"]](*json.loads(job["args"]))
+    except Exception as err:
+        logger.exception("Job %s %s%s failed", job["id"], job["name"], job["args"])
+        # Wait longer after each failure
+        delay = min(30 * 2 ** job["attempts"], 60 * 60)
+        _db.execute(
+            "UPDATE jobs SET next_attempt = ?, last_error = ? WHERE id = ?",
+            time.time() + delay, f"{type(err).__name__}: {err}", job["id"],
+        )
+    else:
+        _db.execute("DELETE FROM jobs WHERE id = ?", job["id"])
+
+
+@contextmanager
+def _heartbeat(job):
+    """Keep renewing the claim on job from another thread until the block ends."""
+    done = threading.Event()
+
+    def renew():
+        until = job["next_attempt"]
+        while not done.wait(HEARTBEAT_SECONDS):
+            renewed = time.time() + VISIBILITY_SECONDS
+            # Only while the claim is still this worker's own
+            if not _db.execute(
+                "UPDATE jobs SET next_attempt = ? WHERE id = ? AND next_attempt = ?", renewed, job["id"], until,
+            ):
+                logger.warning("Job %s %s lost its claim while running", job["id"], job["name"])
+                return
+            until = renewed
+
+    thread = threading.Thread(target=renew, name=f"library-job-{job['id']}-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def _start_workers(threads):
+    with _lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        while len(_workers) < threads:
+            worker = threading.Thread(target=_work, name=f"library-jobs-{len(_workers) + 1}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _work():
+    with _app.app_context():
+        while True:
+            _wakeup.clear()
+            try:
+                run_pending()
+            except Exception:
+                logger.exception("Running jobs failed")
+            _wakeup.wait(POLL_SECONDS)
@@ -0,0 +1,39 @@
+"""
+Fixtures for the tests, run with "python -m pytest tests" after
+"pip install -r tests/requirements.txt".
+
+The app serves a small library built by benchmarks/generate_catalog.py in a
+temporary working directory, with jobs run only when a test asks for them.
+"""
+
+
+import os
+import sys
+
+import pytest
+from flask import current_app
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+from generate_catalog import PASSWORD  # noqa: E402
+from library_app import served_library  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def library(tmp_path_factory):
+    """The app module, serving a generated library, in an app context."""
+    with served_library(
+        tmp_path_factory.mktemp("library"), statistics=False,
+        books=60, authors=20, users=3, pdfs=2, pages=2, page_text=True, report=lambda *args: None,
+    ) as app:
+        yield app
+
+
+@pytest.fixture
+def client(library):
+    return current_app.test_client()
+
+
+@pytest.fixture
+def password():
+    return PASSWORD
@@ -0,0 +1,13 @@
+from helpers import clean_user_input
+
+
+def test_countries_are_found_by_name_code_or_close_misspelling():
+    assert clean_user_input("côte d'ivoire") == "Côte d'Ivoire"
+    assert clean_user_input("NG") == "Nigeria"
+    assert clean_user_input("Untied States") == "United States"
+
+
+def test_inputs_no_country_is_close_to_are_not_guessed():
+    assert clean_user_input("") is None
+    assert clean_user_input("Atlantis") is None
+    assert clean_user_input("x" * 500) is None
@@ -0,0 +1,91 @@
+import json
+import socket
+
+import pytest
+from flask import current_app
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+import mailer  # noqa: E402
+
+REFUSED = "refused@example.com"
+
+
+class Inbox:
+    """An aiosmtpd handler that keeps what it receives and refuses one recipient."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return "550 No such user here"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def inbox(library, monkeypatch):
+    """A local SMTP stand-in the outbox sends to, with an empty outbox."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = Inbox()
+    controller = aiosmtpd.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    for key, value in {"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": port,
+                       "MAIL_USE_TLS": False, "MAIL_USE_SSL": False, "MAIL_USERNAME": None,
+                       "MAIL_PASSWORD": None, "MAIL_SUPPRESS_SEND": False}.items():
+        monkeypatch.setitem(current_app.config, key, value)
+    monkeypatch.setattr(mailer, "_mail", None)
+    library.db.execute("DELETE FROM outbox")
+    yield handler
+    controller.stop()
+
+
+def outbox(library, recipient):
+    """Queue a message for recipient straight into the outbox and return its id."""
+    return library.db.execute(
+        "INSERT INTO outbox (recipients, subject, body, sender) VALUES (?, 'Hello', 'Welcome', ?)",
+        json.dumps([recipient]), json.dumps("library@example.com"),
+    )
+
+
+def row(library, message_id):
+    return library.db.execute("SELECT sent, attempts, last_error FROM outbox WHERE id = ?", message_id)[0]
+
+
+def test_sent_mail_is_marked_sent(library, inbox):
+    message_id = outbox(library, "reader@example.com")
+    assert mailer.send_pending() == 1
+
+    assert [envelope.rcpt_tos for envelope in inbox.messages] == [["reader@example.com"]]
+    sent = row(library, message_id)
+    assert sent["sent"] and sent["attempts"] == 0 and sent["last_error"] is None
+
+
+def test_refused_mail_is_retried_later(library, inbox):
+    message_id = outbox(library, REFUSED)
+    assert mailer.send_pending() == 0
+
+    assert inbox.messages == []
+    refused = row(library, message_id)
+    assert refused["sent"] is None and refused["attempts"] == 1 and "No such user" in refused["last_error"]
+    # Backed off, so the next round leaves it alone
+    assert mailer.send_pending() == 0
+    assert row(library, message_id)["attempts"] == 1
+
+
+def test_mail_claimed_again_by_another_worker_is_not_sent_twice(library, inbox):
+    first, second = outbox(library, "first@example.com"), outbox(library, "second@example.com")
+    rows = sorted(mailer._claim(), key=lambda claimed: claimed["id"])
+    assert [claimed["id"] for claimed in rows] == [first, second]
+
+    # The claim on the first message ran out and another worker took it
+    library.db.execute("UPDATE outbox SET next_attempt = next_attempt + 1 WHERE id = ?", first)
+    assert not mailer._renew(rows[0])
+    assert mailer._renew(rows[1])
@@ -0,0 +1,18 @@
+from flask import current_app
+
+
+def test_metrics_are_not_public_by_default(library, client):
+    # As every request looks behind a reverse proxy on this machine
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "127.0.0.1"}).status_code == 403
+
+
+def test_metrics_answer_allowed_addresses(library, client, monkeypatch):
+    monkeypatch.setitem(current_app.config, "METRICS_ALLOW", ["203.0.113.5"])
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.5"}).status_code == 200
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.6"}).status_code == 403
+
+
+def test_metrics_answer_the_token(library, client, monkeypatch):
+    monkeypatch.setitem(current_app.config, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+    assert client.get("/metrics", headers={"Authorization": "Bearer guess"}).status_code == 403
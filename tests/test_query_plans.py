@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+from database import full_scans
+
+
+# Statements that read a whole table on purpose, by how they start
+WHOLE_TABLE = (
+    # Building the in-memory title and author index at startup
+    "SELECT b.id AS book_id, 'title' AS kind, b.title AS text FROM books b UNION ALL",
+    # The all-time totals of the reads report
+    "SELECT COALESCE(SUM(downloads), 0) AS downloads, COALESCE(SUM(views), 0) AS views FROM book_popularity",
+    # The list of users to make admins from
+    "SELECT id, name, username, mail FROM users",
+)
+
+
+@pytest.fixture
+def queries(library):
+    """Every statement the app runs during a test, with its parameters, in the order first seen."""
+    captured = {}
+    record = library.db.on_query
+
+    def capture(sql, seconds, args=()):
+        captured.setdefault(" ".join(sql.split()), args)
+        if record:
+            record(sql, seconds, args)
+
+    library.db.on_query = capture
+    yield captured
+    library.db.on_query = record
+
+
+def test_queries_use_indexes(library, client, password, queries):
+    """Walk through the app as an admin, then check the plan of every statement it ran."""
+    assert client.post("/login", data={"username": "admin", "password": password}).status_code == 302
+    book = library.db.execute("SELECT book_id, book_title FROM catalog ORDER BY book_title, book_id LIMIT 1 OFFSET 30")[0]
+    for path in ("/", "/shelf", "/shelf?size=12", f"/shelf?after={library.encode_cursor(book['book_title'], book['book_id'])}",
+                 f"/books/{book['book_id']}/download", f"/books/{book['book_id']}/download?view=1",
+                 "/api/search/suggest?q=th", "/search/pages?q=the", "/reports/reads",
+                 "/suggestionsPage", "/suggestionsPage?sort=recent", "/suggestionsPage?status=resolved", "/new_admin"):
+        assert client.get(path).status_code == 200, path
+    assert client.post("/shelf", data={"search": book["book_title"].split()[0]}).status_code == 200
+    assert client.post("/recommendation", data={"newBook": "A Book Nobody Has"}).status_code == 302
+
+    with open(library.db.execute("SELECT book_path FROM files LIMIT 1")[0]["book_path"], "rb") as f:
+        pdf = f.read()
+    assert client.post("/addbook", content_type="multipart/form-data", data={
+        "title": "Plans Of Queries", "publisher": "Index House", "year": "2001", "isbn": "9780000000017",
+        "author": "Ada Planner", "country": "NG", "birth": "1970-01-01", "pdf_file": (io.BytesIO(pdf), "plans.pdf"),
+    }).status_code == 302
+    library.run_pending()
+    added = library.db.execute("SELECT id FROM books WHERE isbn = ?", "9780000000017")[0]["id"]
+    assert client.post("/del_book", data={"book_id": added}).status_code == 302
+    library.run_pending()
+    client.get("/logout")
+
+    scans = {}
+    for sql, args in list(queries.items()):
+        if sql.split(None, 1)[0].upper() in ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "DROP", "ALTER", "EXPLAIN"):
+            continue
+        if sql.startswith(WHOLE_TABLE):
+            continue
+        if plan := full_scans(library.db.query_plan(sql, *args)):
+            scans[sql] = plan
+    assert scans == {}
@@ -0,0 +1,32 @@
+from flask import current_app
+
+
+def session_cookie(client):
+    cookie = client.get_cookie(current_app.config["SESSION_COOKIE_NAME"])
+    return cookie.value if cookie else None
+
+
+def test_login_issues_a_new_session_id(library, client, password):
+    # A session that exists before login, as one planted by an attacker would
+    with client.session_transaction() as session:
+        session["planted"] = True
+    planted = session_cookie(client)
+    assert planted
+
+    assert client.post("/login", data={"username": "admin", "password": password}).status_code == 302
+    signed_in = session_cookie(client)
+    assert signed_in and signed_in != planted
+    assert current_app.session_interface.store.load(planted) is None
+
+    # The old id no longer signs anyone in
+    client.set_cookie(current_app.config["SESSION_COOKIE_NAME"], planted)
+    assert client.get("/shelf").status_code == 302
+
+
+def test_logout_drops_the_session(library, client, password):
+    assert client.post("/login", data={"username": "admin", "password": password}).status_code == 302
+    signed_in = session_cookie(client)
+
+    client.get("/logout")
+    assert session_cookie(client) is None
+    assert current_app.session_interface.store.load(signed_in) is None
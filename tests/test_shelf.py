@@ -0,0 +1,12 @@
+def test_shelf_leaves_out_unknown_countries(library, client, password):
+    db = library.db
+    book_id = db.execute("INSERT INTO books (title, pages) VALUES ('Aaa Stateless Book', 1)")
+    for name, country in [("Known Country", "Ghana"), ("Unknown Country", None)]:
+        author_id = db.execute("INSERT INTO authors (name, country) VALUES (?, ?)", name, country)
+        db.execute("INSERT INTO authored (author_id, book_id) VALUES (?, ?)", author_id, book_id)
+    library.cache.invalidate()
+
+    assert client.post("/login", data={"username": "admin", "password": password}).status_code == 302
+    page = client.get("/shelf").get_data(as_text=True)
+    book = page.split("Aaa Stateless Book", 1)[1].split("Pages:", 1)[0]
+    assert "Country: Ghana</p>" in book
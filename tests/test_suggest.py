@@ -0,0 +1,28 @@
+def add_book(library, title, names):
+    """Shelve a book by authors of the given names, each from another country."""
+    db = library.db
+    book_id = db.execute("INSERT INTO books (title, pages) VALUES (?, 1)", title)
+    for country, name in zip(["NG", "KE", "GH"], names):
+        author_id = db.execute("INSERT INTO authors (name, country) VALUES (?, ?)", name, country)
+        db.execute("INSERT INTO authored (author_id, book_id) VALUES (?, ?)", author_id, book_id)
+    return book_id
+
+
+def test_deleting_a_book_with_a_repeated_author_drops_its_suggestions(library, client):
+    book_id = add_book(library, "Quixotic Zebras", ["Ozymandias Smith", "Ozymandias Smith"])
+    library.suggestions.add_book(book_id, "Quixotic Zebras", ["Ozymandias Smith", "Ozymandias Smith"])
+    assert library.suggestions.suggest("ozymandias") == [("Ozymandias Smith", "author")]
+
+    assert client.post("/del_book", data={"book_id": book_id}).status_code == 302
+    assert library.suggestions.suggest("quixotic") == []
+    assert library.suggestions.suggest("ozymandias") == []
+
+
+def test_rebuilt_suggestions_drop_a_book_with_a_repeated_author(library, client):
+    book_id = add_book(library, "Umbral Yaks", ["Xanthe Okafor", "Xanthe Okafor"])
+    library.suggestions.rebuild()
+    assert library.suggestions.suggest("xanthe") == [("Xanthe Okafor", "author")]
+
+    assert client.post("/del_book", data={"book_id": book_id}).status_code == 302
+    assert library.suggestions.suggest("umbral") == []
+    assert library.suggestions.suggest("xanthe") == []
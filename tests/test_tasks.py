@@ -0,0 +1,26 @@
+import time
+
+import tasks
+
+
+def test_a_running_job_keeps_its_claim(library, monkeypatch):
+    monkeypatch.setattr(tasks, "VISIBILITY_SECONDS", 0.2)
+    monkeypatch.setattr(tasks, "HEARTBEAT_SECONDS", 0.05)
+    seen = []
+
+    @tasks.task("test_slow")
+    def slow():
+        time.sleep(0.5)
+        # Long past the visibility window, yet still hidden from other workers
+        seen.append(library.db.execute("SELECT next_attempt FROM jobs WHERE id = ?", job_id)[0]["next_attempt"])
+        seen.append(time.time())
+
+    # Due before anything else in the queue, so it is the one claimed
+    job_id = tasks.enqueue("test_slow", delay=-10 ** 6)
+    job = tasks._claim()
+    assert job["id"] == job_id
+    tasks._run(job)
+
+    next_attempt, now = seen
+    assert next_attempt > now
+    assert not library.db.execute("SELECT 1 FROM jobs WHERE id = ?", job_id)
@@ -0,0 +1,26 @@
+import base64
+
+import pytest
+
+
+@pytest.fixture
+def admin(client, password):
+    assert client.post("/login", data={"username": "admin", "password": password}).status_code == 302
+    return client
+
+
+@pytest.mark.parametrize("metadata", ["filename !!!", "filename YQ", "filename " + base64.b64encode(b"\xff\xfe").decode()])
+def test_create_refuses_metadata_that_is_not_base64_utf8(admin, metadata):
+    response = admin.post("/api/uploads", headers={"Upload-Length": "10", "Upload-Metadata": metadata})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("checksum", ["sha256 !!!", "sha256 " + base64.b64encode(b"short").decode()])
+def test_finish_refuses_a_checksum_that_is_not_a_sha256_digest(admin, checksum):
+    created = admin.post("/api/uploads", headers={
+        "Upload-Length": "10", "Upload-Metadata": "filename " + base64.b64encode(b"book.pdf").decode()})
+    assert created.status_code == 201
+    fields = dict.fromkeys(("title", "publisher", "author", "country", "birth", "year", "isbn"), "x")
+    response = admin.post(created.json["location"] + "/finish", data=fields, headers={"Upload-Checksum": checksum})
+    assert response.status_code == 400
+    assert "sha256" in response.json["error"]
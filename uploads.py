@@ -0,0 +1,187 @@
+# Chunked, resumable uploads of book files
+
+
+import hashlib
+import os
+import secrets
+import shutil
+import time
+
+
+# Bytes read from a request body at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """An upload request that can't be honoured; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadStore:
+    """
+    Resumable uploads in the style of the tus protocol.
+
+    An upload is created with its total length, receives its bytes in any
+    number of requests that each continue at the offset the server already
+    has, and is finished once complete. Bytes are streamed to a partial file
+    in folder while their SHA-256 is kept up to date, and offsets live in the
+    uploads table, so any worker process can continue any upload. A request
+    claims the upload at its offset in the database before writing, so two
+    processes never write to the same upload at once; a claim lapses when its
+    request has not written anything for claim_seconds.
+    """
+
+    def __init__(self, db, folder, max_length, expire_seconds=24 * 60 * 60, claim_seconds=60):
+        self.db = db
+        self.folder = folder
+        self.max_length = max_length
+        self.expire_seconds = expire_seconds
+        self.claim_seconds = claim_seconds
+        self._hashes = {}
+
+    def create(self, user_id, filename, length):
+        """Start an upload of length bytes and return its id."""
+        if length is None or length < 1:
+            raise UploadError("Upload-Length must be a positive number of bytes")
+        if length > self.max_length:
+            raise UploadError(f"uploads are limited to {self.max_length} bytes", 413)
+        self.sweep()
+
+        upload_id = secrets.token_urlsafe(16)
+        now = time.time()
+        self.db.execute(
+            'INSERT INTO "uploads" ("id", "user_id", "filename", "length", "received", "created", "updated") '
+            "VALUES (?, ?, ?, ?, 0, ?, ?)",
+            upload_id, user_id, filename, length, now, now,
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        open(self._path(upload_id), "wb").close()
+        return upload_id
+
+    def get(self, upload_id, user_id):
+        """Return the upload's row, or None if it does not exist or belongs to someone else."""
+        rows = self.db.execute('SELECT * FROM "uploads" WHERE "id" = ? AND "user_id" = ?', upload_id, user_id)
+        return rows[0] if rows else None
+
+    def append(self, upload, offset, stream):
+        """
+        Write the bytes of stream at offset and return the new offset.
+
+        offset must be what the server has received so far. Bytes that arrive
+        before the client disconnects are kept, so the next request resumes
+        after them.
+        """
+        writer, now = secrets.token_urlsafe(8), time.time()
+        # Check the offset and claim the upload in one statement, so no other
+        # request, in this process or another, can write from the same offset
+        if not self.db.execute(
+            'UPDATE "uploads" SET "writer" = ?, "updated" = ? '
+            'WHERE "id" = ? AND "received" = ? AND ("writer" IS NULL OR "updated" < ?)',
+            writer, now, upload["id"], offset, now - self.claim_seconds,
+        ):
+            current = self.db.execute('SELECT "received" FROM "uploads" WHERE "id" = ?', upload["id"])
+            if current and current[0]["received"] == offset:
+                raise UploadError("another request is writing to this upload", 409)
+            raise UploadError(f"upload is at offset {current[0]['received'] if current else 0}", 409)
+
+        upload = dict(upload, received=offset)
+        digest = self._digest(upload)
+        received, reported = offset, now
+        try:
+            with open(self._path(upload["id"]), "r+b") as f:
+                f.seek(received)
+                while chunk := stream.read(CHUNK_SIZE):
+                    if received + len(chunk) > upload["length"]:
+                        raise UploadError("more bytes than Upload-Length", 413)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+                    # Keep the claim while a slow client is still sending
+                    if time.time() - reported > self.claim_seconds / 4:
+                        reported = time.time()
+                        self.db.execute(
+                            'UPDATE "uploads" SET "updated" = ? WHERE "id" = ? AND "writer" = ?',
+                            reported, upload["id"], writer,
+                        )
+        finally:
+            # Record the bytes written and release the claim, unless it lapsed
+            kept = self.db.execute(
+                'UPDATE "uploads" SET "received" = ?, "updated" = ?, "writer" = NULL '
+                'WHERE "id" = ? AND "received" = ? AND "writer" = ?',
+                received, time.time(), upload["id"], offset, writer,
+            )
+            if kept:
+                self._hashes[upload["id"]] = (received, digest)
+        if not kept:
+            raise UploadError("upload was taken over by another request", 409)
+        return received
+
+    def finish(self, upload, checksum=None):
+        """
+        Return (path, sha256) of a complete upload's file, leaving the upload in place.
+
+        checksum, if given, is the hex SHA-256 the client computed; a mismatch
+        raises UploadError.
+        """
+        if upload["received"] != upload["length"]:
+            raise UploadError(f"upload has {upload['received']} of {upload['length']} bytes", 409)
+        sha256 = self._digest(upload).hexdigest()
+        if checksum and checksum.lower() != sha256:
+            raise UploadError("checksum does not match the uploaded bytes", 460)
+        return self._path(upload["id"]), sha256
+
+    def discard(self, upload_id):
+        """Forget an upload and remove whatever is left of its file."""
+        self._hashes.pop(upload_id, None)
+        self.db.execute('DELETE FROM "uploads" WHERE "id" = ?', upload_id)
+        if os.path.exists(self._path(upload_id)):
+            os.remove(self._path(upload_id))
+
+    def sweep(self):
+        """Discard uploads nobody has added to for expire_seconds."""
+        for row in self.db.execute('SELECT "id" FROM "uploads" WHERE "updated" < ?', time.time() - self.expire_seconds):
+            self.discard(row["id"])
+
+    def _digest(self, upload):
+        """The running SHA-256 of an upload, rebuilt from its file if another process received the bytes."""
+        received, digest = self._hashes.get(upload["id"], (0, None))
+        if digest is None or received != upload["received"]:
+            digest = hashlib.sha256()
+            with open(self._path(upload["id"]), "rb") as f:
+                remaining = upload["received"]
+                while remaining and (chunk := f.read(min(CHUNK_SIZE, remaining))):
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+        return digest.copy()
+
+    def _path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.part")
+
+
+def store_content_addressed(path, sha256, folder, extension, keep=False):
+    """
+    Move a finished file into folder under its SHA-256, so identical books share one file.
+
+    Returns (stored_path, created); created is False when the same content was
+    already stored, in which case path is simply removed. With keep, path is
+    left in place and the stored file is a hard link to it (or a copy).
+    """
+    os.makedirs(folder, exist_ok=True)
+    target = os.path.join(folder, f"{sha256}{extension.lower()}")
+    if os.path.exists(target):
+        if not keep:
+            os.remove(path)
+        return target, False
+    if not keep:
+        os.replace(path, target)
+        return target, True
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        return target, False
+    except OSError:
+        shutil.copyfile(path, target)
+    return target, True